@@ -1,11 +1,119 @@
+import time
+STARTUP_BEGIN = time.perf_counter()  # Start of module import, for the startup-time breakdown
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk, ImageOps, ImageSequence
-import tensorflow as tf
 import numpy as np
+import argparse
+import hashlib
+import io
+import itertools
+import json
 import os
+import shutil
+import sqlite3
+import tempfile
 import threading
 import queue
+import re
+import multiprocessing
+import sys
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+IMPORTS_DONE = time.perf_counter()
+
+IMAGE_SIZE = (224, 224)  # Input size expected by EfficientNetB0
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+CLIP_EXTENSIONS = ('.gif',)  # Multi-frame files classified as clips
+CLIP_SAMPLE_EVERY = 5  # Default frame sampling interval of clips
+DEFAULT_SCENE_THRESHOLD = 0.1  # Mean grayscale change that counts as a scene change
+SCENE_SIGNATURE_SIZE = (32, 32)  # Grayscale thumbnail compared for scene changes
+PREVIEW_SIZE = (350, 350)  # Bounding box of the uploaded image preview
+DHASH_THUMBNAIL = (9, 8)  # Grayscale thumbnail compared by the perceptual hash
+DEFAULT_DEDUP_DISTANCE = 4  # Bits two perceptual hashes may differ by for --dedup
+EXIF_ORIENTATION = 0x0112
+PREPROCESSING_VERSION = 2  # Part of the prediction cache key; bump when decoding changes model inputs
+DECODE_BENCHMARK_SIZES = [(1600, 1200), (3000, 2000), (4000, 3000), (6000, 4000)]  # 2 to 24 megapixels
+DEFAULT_BATCH_SIZE = 32  # Images sent to the model per predict call in folder mode
+
+MODEL_NAME = 'efficientnetb0'  # Default model tier
+# Model tiers, fastest first: keras.applications constructor and published ImageNet top-1 accuracy (%).
+# All take 224x224 RGB in 0-255 (their preprocessing is built in) and predict the 1000 ImageNet
+# classes, so they share the decode pipeline, preprocess_input and decode_predictions.
+MODEL_TIERS = {
+    'mobilenetv3small': {'application': 'MobileNetV3Small', 'top1_accuracy': 67.4},
+    'efficientnetb0': {'application': 'EfficientNetB0', 'top1_accuracy': 77.1},
+    'convnexttiny': {'application': 'ConvNeXtTiny', 'top1_accuracy': 81.3},
+}
+TIER_BENCHMARK_RUNS = 20  # Timed single-image predictions per tier
+TIER_BENCHMARK_FILE = 'tier_benchmarks.json'  # Per-host tier latencies, kept in the model store
+# Local model store; override with --model-store or the IMAGE_CLASSIFIER_MODEL_STORE variable
+DEFAULT_MODEL_STORE = os.environ.get('IMAGE_CLASSIFIER_MODEL_STORE', os.path.join(os.path.expanduser('~'), '.image_classifier', 'models'))
+# On-disk prediction cache; override with --cache-dir or the IMAGE_CLASSIFIER_CACHE variable
+DEFAULT_CACHE_DIR = os.environ.get('IMAGE_CLASSIFIER_CACHE', os.path.join(os.path.expanduser('~'), '.image_classifier', 'predictions'))
+CACHE_MEMORY_ENTRIES = 4096  # Predictions kept in the in-memory LRU tier
+CACHE_MAX_DISK_MB = 256  # Size limit of the on-disk tier
+# Similarity index; override with --index-dir or the IMAGE_CLASSIFIER_INDEX variable
+DEFAULT_INDEX_DIR = os.environ.get('IMAGE_CLASSIFIER_INDEX', os.path.join(os.path.expanduser('~'), '.image_classifier', 'index'))
+EMBEDDING_LAYER = 'avg_pool'  # Pooled penultimate layer of EfficientNetB0 (1280 features)
+QUERY_CHUNK_ROWS = 65536  # Index rows scored at a time
+# Results database; override with --results-db or the IMAGE_CLASSIFIER_RESULTS variable
+DEFAULT_RESULTS_DB = os.environ.get('IMAGE_CLASSIFIER_RESULTS', os.path.join(os.path.expanduser('~'), '.image_classifier', 'results.sqlite3'))
+# Pre-rendered UI assets; override with --asset-dir or the IMAGE_CLASSIFIER_ASSETS variable
+DEFAULT_ASSET_DIR = os.environ.get('IMAGE_CLASSIFIER_ASSETS', os.path.join(os.path.expanduser('~'), '.image_classifier', 'assets'))
+LOADER_FRAME_SIZE = (50, 50)  # Size of the loader animation frames
+# Gallery thumbnails; override with --thumbnail-dir or the IMAGE_CLASSIFIER_THUMBNAILS variable
+DEFAULT_THUMBNAIL_DIR = os.environ.get('IMAGE_CLASSIFIER_THUMBNAILS', os.path.join(os.path.expanduser('~'), '.image_classifier', 'thumbnails'))
+THUMBNAIL_SIZE = (128, 128)  # Bounding box of a gallery thumbnail
+THUMBNAIL_MEMORY_ENTRIES = 512  # Decoded thumbnails kept in memory
+THUMBNAIL_WORKERS = 2  # Threads decoding gallery thumbnails
+GALLERY_CELL = (150, 170)  # Width and height of one gallery cell: thumbnail plus caption
+# Watch-mode manifests; override with --manifest or the IMAGE_CLASSIFIER_MANIFESTS variable
+DEFAULT_MANIFEST_DIR = os.environ.get('IMAGE_CLASSIFIER_MANIFESTS', os.path.join(os.path.expanduser('~'), '.image_classifier', 'manifests'))
+WATCH_INTERVAL = 2.0  # Seconds between polls of the watched folder
+WATCH_SETTLE_SECONDS = 1.0  # Files modified more recently than this may still be being written
+CLASS_INDEX_URL = 'https://storage.googleapis.com/download.tensorflow.org/data/imagenet_class_index.json'
+
+DEFAULT_DECODE_WORKERS = min(4, os.cpu_count() or 1)  # Parallel image decoders in bulk classification
+PREFETCH_BATCHES = 2  # Batches decoded ahead of the model
+SHARD_BENCHMARK_IMAGES = 256  # Images classified per configuration by --benchmark-sharding
+SHARD_STARTUP_TIMEOUT = 600  # Seconds a sharded worker waits for the others to load their model
+
+# Pipeline stages timed by the latency instrumentation, in order
+STAGES = ('open', 'decode', 'resize', 'preprocess', 'predict', 'decode_predictions', 'gui_update')
+STATS_WINDOW = 1000  # Samples per stage kept for the rolling percentiles
+STATS_REFRESH_MS = 1000  # Refresh interval of the GUI stats panel
+
+SERVER_HOST = '127.0.0.1'  # The inference service only listens on loopback by default
+SERVER_PORT = 8765
+SERVER_MAX_BATCH_SIZE = 32  # Most requests grouped into one predict call
+SERVER_MAX_WAIT_MS = 5.0  # How long the first request of a batch waits for others
+THROUGHPUT_WINDOW = 60  # Seconds of history behind the reported throughput
+
+PRIORITY_INTERACTIVE = 0  # Single-image clicks run ahead of queued folder batches
+PRIORITY_BULK = 1
+MAX_PENDING_JOBS = 8  # Bound on the inference worker's job queue
+FOLDER_BATCHES_AHEAD = 2  # Folder batches kept queued ahead of the worker
+POLL_INTERVAL_MS = 50  # How often the Tk main loop polls for results
+
+# TensorFlow is imported lazily by load_tensorflow() so the window can open before it is ready
+tf = None
+EfficientNetB0 = preprocess_input = decode_predictions = None
+
+def load_tensorflow():
+    global tf, EfficientNetB0, preprocess_input, decode_predictions
+    if tf is None:
+        import tensorflow
+        from tensorflow.keras.applications import efficientnet
+        EfficientNetB0 = efficientnet.EfficientNetB0
+        preprocess_input = efficientnet.preprocess_input
+        decode_predictions = efficientnet.decode_predictions
+        tf = tensorflow
+    return tf
 
 # Multiple decorators to check for file existence and supported image formats
 def file_exists(func):
@@ -19,40 +127,2290 @@ def file_exists(func):
 
 def supported_format(func):
     def wrapper(*args, **kwargs):
-        if args[0].image_path and args[0].image_path.lower().endswith(('.png', '.jpg', '.jpeg')):
+        if args[0].image_path and args[0].image_path.lower().endswith(SUPPORTED_EXTENSIONS + CLIP_EXTENSIONS):
             return func(*args, **kwargs)
         else:
-            messagebox.showerror('Error', 'Unsupported file format! Only PNG/JPG/JPEG allowed')
+            messagebox.showerror('Error', 'Unsupported file format! Only PNG/JPG/JPEG/GIF allowed')
             return None
     return wrapper
 
+# SHA-256 of a file, read in chunks
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# decode_predictions equivalent that reads the ImageNet class index from a local file
+def make_decode_predictions(class_index_path):
+    with open(class_index_path) as f:
+        class_index = json.load(f)
+
+    def decode(predictions, top=5):
+        results = []
+        for pred in np.asarray(predictions):
+            top_indices = pred.argsort()[-top:][::-1]
+            results.append([tuple(class_index[str(i)]) + (float(pred[i]),) for i in top_indices])
+        return results
+    return decode
+
+# Local store holding a serialized, ready-to-load model, its checksum and the ImageNet class index,
+# so that launches after the first one need neither the network nor a rebuild from Python
+class ModelStore:
+    def __init__(self, path=DEFAULT_MODEL_STORE, name=MODEL_NAME):
+        self.path = path
+        self.name = name
+        self.model_path = os.path.join(path, f'{name}.keras')
+        self.checksum_path = self.model_path + '.sha256'
+        # Optional pre-downloaded weights for building the model on a machine with no network
+        self.weights_path = os.path.join(path, f'{name}.h5')
+        self.class_index_path = os.path.join(path, 'imagenet_class_index.json')
+        self.checksum = None  # Checksum of the loaded model, used as its identity
+
+    # True if the serialized model is present and matches its checksum
+    def is_intact(self):
+        if not (os.path.isfile(self.model_path) and os.path.isfile(self.checksum_path)):
+            return False
+        with open(self.checksum_path) as f:
+            expected = f.read().strip()
+        actual = file_sha256(self.model_path)
+        if actual != expected:
+            print(f"Checksum mismatch for {self.model_path}, rebuilding the model")
+            return False
+        self.checksum = actual
+        return True
+
+    # Load the serialized model if present and intact; returns None otherwise
+    def load(self):
+        if not self.is_intact():
+            return None
+        return tf.keras.models.load_model(self.model_path, compile=False)
+
+    # Serialize the model and write its checksum next to it. Temporary files are per process,
+    # so processes saving the same model at once do not replace each other's files.
+    def save(self, model):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f'{self.model_path}.{os.getpid()}.tmp.keras'
+        model.save(tmp_path)
+        os.replace(tmp_path, self.model_path)
+        self.checksum = file_sha256(self.model_path)
+        tmp_path = f'{self.checksum_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.checksum + '\n')
+        os.replace(tmp_path, self.checksum_path)
+
+    # Keep a copy of the ImageNet class index in the store and return a decoder reading it
+    def load_decoder(self):
+        if not os.path.isfile(self.class_index_path):
+            downloaded = tf.keras.utils.get_file('imagenet_class_index.json', CLASS_INDEX_URL, cache_subdir='models')
+            os.makedirs(self.path, exist_ok=True)
+            shutil.copyfile(downloaded, self.class_index_path)
+        return make_decode_predictions(self.class_index_path)
+
+    def load_or_build(self):
+        model = self.load()
+        if model is None:
+            weights = self.weights_path if os.path.isfile(self.weights_path) else 'imagenet'
+            model = tier_application(self.name)(weights=weights, input_shape=IMAGE_SIZE + (3,))
+            self.save(model)
+        return model
+
+# keras.applications constructor of a model tier
+def tier_application(tier):
+    return getattr(tf.keras.applications, MODEL_TIERS[tier]['application'])
+
+model_store_dir = DEFAULT_MODEL_STORE  # Set to None to always build the model from keras.applications
+model_identity = f'{MODEL_NAME}-imagenet'  # Identifies the loaded model's weights in cache keys
+model_tier = MODEL_NAME  # Tier used unless a latency budget picks one
+latency_budget_ms = None  # Per-image budget; picks the most accurate tier that fits
+cascade_threshold = None  # Escalate from the fastest tier when its top-1 confidence is below this
+active_model = MODEL_NAME  # Description of what build_backend loaded, for status lines
+
+# Build a pre-trained model tier, EfficientNetB0 by default (shared by the GUI and headless mode)
+def build_model(tier=None):
+    global decode_predictions, model_identity
+    tier = tier or model_tier
+    load_tensorflow()
+    if model_store_dir is None:
+        model_identity = f'{tier}-imagenet'
+        return tier_application(tier)(weights='imagenet', input_shape=IMAGE_SIZE + (3,))
+    store = ModelStore(model_store_dir, tier)
+    model = store.load_or_build()
+    decode_predictions = store.load_decoder()
+    model_identity = f'{tier}-{store.checksum}'
+    return model
+
+# Latencies are only comparable on the machine they were measured on
+def host_fingerprint():
+    import platform
+    return {'node': platform.node(), 'machine': platform.machine(), 'cpus': os.cpu_count(), 'tensorflow': tf.__version__}
+
+# Median warm single-image latency of one tier on this host, in milliseconds
+def benchmark_tier(tier, runs=TIER_BENCHMARK_RUNS):
+    predict_fn = make_predict_fn(build_model(tier))
+    warm_up(predict_fn)
+    img_array = np.random.uniform(0, 255, (1,) + IMAGE_SIZE + (3,)).astype(np.float32)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        np.asarray(predict_fn(img_array))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+# Per-tier latencies on this host, measured once and kept in the model store. They are measured
+# again for a different host or TensorFlow version, or when refresh is set.
+def load_tier_benchmarks(refresh=False):
+    global model_identity
+    load_tensorflow()
+    path = os.path.join(model_store_dir or DEFAULT_MODEL_STORE, TIER_BENCHMARK_FILE)
+    host = host_fingerprint()
+    benchmarks = {}
+    if os.path.isfile(path) and not refresh:
+        with open(path) as f:
+            saved = json.load(f)
+        if saved.get('host') == host:
+            benchmarks = saved['latency_ms']
+    missing = [tier for tier in MODEL_TIERS if tier not in benchmarks]
+    if missing:
+        identity = model_identity  # Building each tier replaces it
+        for tier in missing:
+            print(f"Benchmarking model tier {tier} on this host...", flush=True)
+            benchmarks[tier] = benchmark_tier(tier)
+        model_identity = identity
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'host': host, 'latency_ms': benchmarks}, f, indent=1)
+        os.replace(tmp_path, path)
+    return benchmarks
+
+# The most accurate tier whose latency fits the budget, or the fastest tier if none does
+def choose_tier(budget_ms, benchmarks):
+    fitting = [tier for tier in MODEL_TIERS if benchmarks[tier] <= budget_ms]
+    if not fitting:
+        fastest = min(MODEL_TIERS, key=benchmarks.get)
+        print(f"No model tier fits {budget_ms:.0f} ms per image on this host, using the fastest ({fastest})")
+        return fastest
+    return max(fitting, key=lambda tier: MODEL_TIERS[tier]['top1_accuracy'])
+
+# Tier to load: chosen by the latency budget if one is set, else model_tier
+def resolve_tier():
+    if latency_budget_ms is None:
+        return model_tier
+    benchmarks = load_tier_benchmarks()
+    tier = choose_tier(latency_budget_ms, benchmarks)
+    print(f"Latency budget {latency_budget_ms:.0f} ms: using {tier} ({benchmarks[tier]:.1f} ms per image on this host)")
+    return tier
+
+# Print the tier table for this host
+def report_tiers(refresh=True):
+    benchmarks = load_tier_benchmarks(refresh)
+    print(f"{'tier':<18} {'ImageNet top-1':>15} {'latency':>10}")
+    for tier, info in MODEL_TIERS.items():
+        print(f"{tier:<18} {info['top1_accuracy']:>14.1f}% {benchmarks[tier]:>7.1f} ms")
+    if latency_budget_ms is not None:
+        print(f"Within {latency_budget_ms:.0f} ms: {choose_tier(latency_budget_ms, benchmarks)}")
+    return 0
+
+# Report cold-start time with and without the model store
+def measure_cold_start(store_dir=DEFAULT_MODEL_STORE):
+    start = time.perf_counter()
+    load_tensorflow()
+    print(f"Import TensorFlow:                 {(time.perf_counter() - start) * 1000:8.0f} ms")
+
+    # Build from the store's pre-downloaded weights when present, so no step needs the network
+    store = ModelStore(store_dir)
+    offline = os.path.isfile(store.weights_path)
+    start = time.perf_counter()
+    try:
+        EfficientNetB0(weights=store.weights_path if offline else 'imagenet')
+        print(f"Build from keras.applications:     {(time.perf_counter() - start) * 1000:8.0f} ms"
+              + (" (stored weights)" if offline else " (weights download)"))
+    except Exception as e:
+        print(f"Build from keras.applications:     skipped, no {store.weights_path} and the weights download failed ({e})")
+
+    if store.load() is None:
+        start = time.perf_counter()
+        try:
+            store.load_or_build()
+        except Exception as e:
+            print(f"First launch (build + serialize):  failed, no stored model or weights and the download failed ({e})")
+            return 1
+        print(f"First launch (build + serialize):  {(time.perf_counter() - start) * 1000:8.0f} ms")
+
+    start = time.perf_counter()
+    store.load()
+    print(f"Load from model store (+checksum): {(time.perf_counter() - start) * 1000:8.0f} ms")
+
+    cached = os.path.isfile(store.class_index_path)
+    start = time.perf_counter()
+    try:
+        store.load_decoder()
+        print(f"Load class index:                  {(time.perf_counter() - start) * 1000:8.0f} ms"
+              + ("" if cached else " (downloaded)"))
+    except Exception as e:
+        print(f"Load class index:                  skipped, not in the store and the download failed ({e})")
+    return 0
+
+# Add the time spent in a with-block to timings[stage] (timings may be None to skip timing)
+@contextmanager
+def timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+# Rolling per-stage latencies over the last `window` samples of each stage
+class LatencyStats:
+    def __init__(self, window=STATS_WINDOW):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds, count=1):
+        # A stage timed over a whole batch is recorded as `count` per-image samples
+        with self.lock:
+            samples = self.samples.setdefault(stage, deque(maxlen=self.window))
+            samples.extend([seconds / count] * count)
+
+    def record_all(self, timings, count=1):
+        for stage, seconds in timings.items():
+            self.record(stage, seconds, count)
+
+    # {stage: {'count', 'p50_ms', 'p95_ms', 'p99_ms'}} in pipeline order
+    def summary(self):
+        with self.lock:
+            samples = {stage: np.array(values) * 1000 for stage, values in self.samples.items() if values}
+        ordered = [stage for stage in STAGES if stage in samples] + sorted(set(samples) - set(STAGES))
+        return {stage: {'count': len(samples[stage]),
+                        'p50_ms': round(float(np.percentile(samples[stage], 50)), 2),
+                        'p95_ms': round(float(np.percentile(samples[stage], 95)), 2),
+                        'p99_ms': round(float(np.percentile(samples[stage], 99)), 2)}
+                for stage in ordered}
+
+    def report_text(self):
+        lines = [f"{'stage':<18} {'p50':>7} {'p95':>7} {'p99':>7}  (ms)"]
+        for stage, row in self.summary().items():
+            lines.append(f"{stage:<18} {row['p50_ms']:7.1f} {row['p95_ms']:7.1f} {row['p99_ms']:7.1f}")
+        return "\n".join(lines)
+
+latency_stats = LatencyStats()  # Shared by the GUI and headless mode
+
+# Open an image decoded at roughly the size it is needed at, upright and in RGB.
+# For JPEGs, draft mode makes the decoder scale by 1/2, 1/4 or 1/8 while decoding,
+# never below target_size, which is much faster and smaller than a full decode.
+# EXIF orientation is applied so rotated camera photos are shown and classified upright.
+def open_image(path, target_size, timings=None):
+    with timed(timings, 'open'):
+        img = Image.open(path)
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    with img:
+        # Orientations 5-8 are rotated by 90 degrees, so the stored image is transposed
+        draft_size = target_size[::-1] if orientation in (5, 6, 7, 8) else target_size
+        with timed(timings, 'decode'):
+            img.draft('RGB', draft_size)
+            img = ImageOps.exif_transpose(img)
+            return img.convert('RGB')
+
+# Decode an image file into a 224x224 RGB array (before preprocess_input)
+def load_image_array(path, timings=None):
+    img = open_image(path, IMAGE_SIZE, timings)
+    with timed(timings, 'resize'):
+        return np.array(img.resize(IMAGE_SIZE))
+
+# Decode like load_image_array did before draft mode: full resolution, no EXIF handling
+def load_image_array_full(path):
+    with Image.open(path) as img:
+        return np.array(img.convert('RGB').resize(IMAGE_SIZE))
+
+# Time one decode path on one file. Runs in a fresh process so the ru_maxrss growth is its peak memory.
+def measure_decode(path, use_draft, runs):
+    try:
+        import resource
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:  # Not available on Windows
+        resource = None
+    decode = load_image_array if use_draft else load_image_array_full
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        decode(path)
+        timings.append((time.perf_counter() - start) * 1000)
+    peak_mb = None
+    if resource is not None:
+        peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024  # ru_maxrss is in KiB on Linux
+    return float(np.median(timings)), peak_mb
+
+# Write synthetic camera-sized JPEGs for the decode benchmark
+def write_synthetic_photos(folder, sizes=DECODE_BENCHMARK_SIZES):
+    paths = []
+    for i, (width, height) in enumerate(sizes):
+        path = os.path.join(folder, f'photo{i:03d}.jpg')
+        # Smooth gradient plus noise compresses like a real photo
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+        noise = np.random.normal(0, 20, (height, width, 3))
+        Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8)).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+# Compare full decoding with draft-mode decoding by image size, on synthetic camera photos or a folder
+def benchmark_decode(folder=None, runs=5):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context = multiprocessing.get_context('spawn')
+        if folder:
+            paths = list_image_files(folder)[:20]
+        else:
+            # Written by a child process: ru_maxrss carries over to spawned children on Linux,
+            # so this process must stay small for the per-decode peaks to be visible
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                paths = executor.submit(write_synthetic_photos, tmp_dir).result()
+
+        print(f"{'image':<28} {'full decode':>12} {'draft decode':>13} {'full peak':>10} {'draft peak':>11}")
+        for path in paths:
+            with Image.open(path) as img:
+                label = f"{os.path.basename(path)[:16]} {img.width}x{img.height}"
+            row = []
+            for use_draft in (False, True):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    row.append(executor.submit(measure_decode, path, use_draft, runs).result())
+            (full_ms, full_mb), (draft_ms, draft_mb) = row
+            memory = (f"{full_mb:7.1f} MB {draft_mb:8.1f} MB" if full_mb is not None else "       n/a         n/a")
+            print(f"{label:<28} {full_ms:9.1f} ms {draft_ms:10.1f} ms {memory}")
+    return 0
+
+# Decode and preprocess one image into a (1, 224, 224, 3) float32 batch
+def preprocess_image(path, timings=None):
+    img_array = load_image_array(path, timings)
+    with timed(timings, 'preprocess'):
+        img_array = np.expand_dims(img_array, axis=0).astype(np.float32)
+        return preprocess_input(img_array)  # Use EfficientNet's preprocessing
+
+# Build a single-image inference function that is traced once with a fixed input signature,
+# so each click skips the data adapter and step function that model.predict rebuilds per call
+def make_predict_fn(model, jit_compile=False):
+    @tf.function(input_signature=[tf.TensorSpec((1,) + IMAGE_SIZE + (3,), tf.float32)], jit_compile=jit_compile)
+    def predict_fn(img_array):
+        return model(img_array, training=False)
+    return predict_fn
+
+# Run one dummy image through the function so tracing (and XLA compilation) happens at load time
+def warm_up(predict_fn):
+    predict_fn(tf.zeros((1,) + IMAGE_SIZE + (3,), tf.float32))
+
+BACKENDS = ('keras', 'tflite-fp16', 'tflite-int8')
+CALIBRATION_IMAGES = 100  # Images used to calibrate int8 quantization
+
+# Runs a converted .tflite model with the same predict/call interface as the Keras model,
+# so it can be used by classify_files and as the single-image predict_fn
+class TFLiteModel:
+    def __init__(self, path, num_threads=None):
+        try:
+            # Standalone LiteRT runtime, which replaces tf.lite.Interpreter in newer TensorFlow releases
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+
+    # Single image of shape (1, 224, 224, 3)
+    def __call__(self, img_array):
+        img_array = np.asarray(img_array, dtype=np.float32)
+        scale, zero_point = self.input_detail['quantization']
+        if self.input_detail['dtype'] != np.float32:
+            img_array = np.round(img_array / scale + zero_point)
+        self.interpreter.set_tensor(self.input_detail['index'], img_array.astype(self.input_detail['dtype']))
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_detail['index'])
+        scale, zero_point = self.output_detail['quantization']
+        if self.output_detail['dtype'] != np.float32:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    # The interpreter has a fixed batch size of 1, so batches are run image by image
+    def predict(self, batch, batch_size=None, verbose=0):
+        return np.concatenate([self(img[np.newaxis]) for img in np.asarray(batch)])
+
+# Yield preprocessed calibration images for int8 quantization
+def calibration_images(folder=None, count=CALIBRATION_IMAGES):
+    paths = list_image_files(folder)[:count] if folder else []
+    if paths:
+        for path in paths:
+            yield [preprocess_image(path)]
+    else:
+        # Without real photos the int8 ranges are only a rough estimate
+        print("No calibration images given, calibrating int8 quantization on random noise")
+        for _ in range(count):
+            yield [preprocess_input(np.random.uniform(0, 255, (1,) + IMAGE_SIZE + (3,)).astype(np.float32))]
+
+# Convert the Keras model into a float16 or int8-quantized .tflite file
+def convert_to_tflite(model, backend, output_path, calibration_dir=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if backend == 'tflite-fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # Input and output stay float32; weights and activations are int8
+        converter.representative_dataset = lambda: calibration_images(calibration_dir)
+    tflite_model = converter.convert()
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+inference_backend = 'keras'  # One of BACKENDS
+tflite_threads = None  # Interpreter threads (None lets TFLite decide)
+calibration_dir = None  # Folder of photos used to calibrate int8 quantization
+
+# Path of the converted artifact; named after the Keras model's identity so new weights trigger a new conversion
+def tflite_path(backend, identity=None):
+    return os.path.join(model_store_dir or DEFAULT_MODEL_STORE, f'{identity or model_identity}-{backend[len("tflite-"):]}.tflite')
+
+# Load the TFLite version of a Keras model, converting it on first use
+def load_tflite(model, backend):
+    path = tflite_path(backend)
+    if not os.path.isfile(path):
+        print(f"Converting the model to {backend}: {path}")
+        convert_to_tflite(model, backend, path, calibration_dir)
+    return TFLiteModel(path, tflite_threads)
+
+# Runs the fast tier on every image and the accurate tier only on images whose fast top-1
+# confidence is below threshold. Predictions have the same shape as a single model's.
+class CascadeModel:
+    def __init__(self, fast, accurate, threshold):
+        self.fast = fast
+        self.accurate = accurate
+        self.threshold = threshold
+        self.fast_fn = self.accurate_fn = None  # Compiled single-image functions, built on first call
+        self.lock = threading.Lock()
+        self.images = 0
+        self.escalated = 0
+
+    def count(self, images, escalated):
+        with self.lock:
+            self.images += images
+            self.escalated += escalated
+
+    def predict(self, batch, batch_size=None, verbose=0):
+        batch = np.asarray(batch)
+        predictions = np.array(self.fast.predict(batch, batch_size=len(batch), verbose=0))
+        uncertain = np.flatnonzero(predictions.max(axis=1) < self.threshold)
+        if len(uncertain):
+            predictions[uncertain] = self.accurate.predict(batch[uncertain], batch_size=len(uncertain), verbose=0)
+        self.count(len(batch), len(uncertain))
+        return predictions
+
+    # Single-image path used by the GUI
+    def __call__(self, img_array, training=False):
+        if self.fast_fn is None:
+            self.fast_fn = make_predict_fn(self.fast)
+            self.accurate_fn = make_predict_fn(self.accurate)
+        predictions = np.asarray(self.fast_fn(img_array))
+        escalate = predictions.max() < self.threshold
+        if escalate:
+            predictions = np.asarray(self.accurate_fn(img_array))
+        self.count(1, int(escalate))
+        return predictions
+
+    def stats_text(self):
+        return f"Cascade: {self.escalated}/{self.images} escalated"
+
+# Fastest tier on this host in front of `tier`
+def build_cascade(tier, threshold):
+    global model_identity, active_model
+    benchmarks = load_tier_benchmarks()
+    fast_tier = min(MODEL_TIERS, key=benchmarks.get)
+    if fast_tier == tier:
+        print(f"{tier} is already the fastest tier, running it without a cascade")
+        active_model = tier
+        return build_model(tier)
+    fast = build_model(fast_tier)
+    fast_identity = model_identity
+    accurate = build_model(tier)
+    model_identity = f'cascade-{fast_identity}-{model_identity}-{threshold}'
+    active_model = f'{fast_tier} -> {tier} below {threshold:.0%}'
+    return CascadeModel(fast, accurate, threshold)
+
+# Build the model for the configured backend
+def build_backend(backend=None):
+    global model_identity, active_model
+    backend = backend or inference_backend
+    tier = resolve_tier()
+    if cascade_threshold is not None:
+        if backend != 'keras':
+            print("The cascade runs on the keras backend")
+        return build_cascade(tier, cascade_threshold)
+    active_model = tier if backend == 'keras' else f'{tier} ({backend})'
+    model = build_model(tier)
+    if backend == 'keras':
+        return model
+    tflite_model = load_tflite(model, backend)
+    model_identity = f'{model_identity}-{backend}'  # TFLite predictions are cached separately
+    return tflite_model
+
+# Compare TFLite backends against model.predict on a folder of images:
+# per-image latency and agreement with the Keras predictions
+def compare_backends(folder, top=5):
+    paths = list_image_files(folder)
+    if not paths:
+        print(f"No PNG/JPG/JPEG files found in {folder}")
+        return 1
+    model = build_model()
+    images = []
+    for path in paths:
+        try:
+            images.append(preprocess_image(path))
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    if not images:
+        print(f"None of the {len(paths)} image(s) in {folder} could be decoded")
+        return 1
+    reference = None
+    print(f"Backend comparison on {len(images)} images (agreement is measured against model.predict):")
+    for backend in BACKENDS:
+        if backend == 'keras':
+            predict = lambda img_array: model.predict(img_array, verbose=0)
+        else:
+            predict = load_tflite(model, backend)
+        predict(images[0])  # Warm up
+        timings = []
+        outputs = []
+        for img_array in images:
+            start = time.perf_counter()
+            outputs.append(np.asarray(predict(img_array))[0])
+            timings.append((time.perf_counter() - start) * 1000)
+        outputs = np.array(outputs)
+        top_k = np.argsort(outputs, axis=1)[:, ::-1][:, :top]
+        if reference is None:
+            reference = top_k
+        top1 = np.mean(top_k[:, 0] == reference[:, 0]) * 100
+        overlap = np.mean([len(set(a) & set(b)) / top for a, b in zip(top_k, reference)]) * 100
+        print(f"  {backend:<12} median {np.median(timings):7.1f} ms   p95 {np.percentile(timings, 95):7.1f} ms   "
+              f"top-1 agreement {top1:5.1f}%   top-{top} overlap {overlap:5.1f}%")
+    return 0
+
+# Collect all supported image files below a folder, sorted for a stable order
+def list_image_files(folder):
+    paths = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+# Turn decode_predictions output into "Label (xx.xx%)" strings
+def format_predictions(decoded_predictions):
+    return [f"{label.replace('_', ' ').title()} ({confidence*100:.2f}%)" for _, label, confidence in decoded_predictions]
+
+# Cache key: hash of the model identity and the file's SHA-256, so the file is read once for both
+def cache_key(content_hash, model_id):
+    return hashlib.sha256(f'{model_id}|{PREPROCESSING_VERSION}|{content_hash}'.encode()).hexdigest()
+
+def content_key(path, model_id):
+    return cache_key(file_sha256(path), model_id)
+
+def cache_file_path(cache_root, key):
+    return os.path.join(cache_root, key[:2], key + '.npy')
+
+# Prediction cache keyed by a hash of the file contents and the model identity.
+# A hit returns the stored probability vector, skipping image decode and inference.
+# Recently used entries live in an in-memory LRU; all entries are also kept on disk
+# as .npy files, and the least recently used ones are evicted once the directory
+# grows past max_disk_bytes.
+class PredictionCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, memory_entries=CACHE_MEMORY_ENTRIES, max_disk_bytes=CACHE_MAX_DISK_MB << 20):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.disk_bytes = None  # Size of the on-disk tier, measured on first write
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path, model_id):
+        return content_key(path, model_id)
+
+    def disk_path(self, key):
+        return cache_file_path(self.cache_dir, key)
+
+    # Return the cached predictions for a key, or None on a miss
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        path = self.disk_path(key)
+        try:
+            predictions = np.load(path)
+            os.utime(path)  # Mark as recently used for disk eviction
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.remember(key, predictions)
+        return predictions
+
+    def put(self, key, predictions):
+        predictions = np.asarray(predictions, dtype=np.float32)
+        with self.lock:
+            self.remember(key, predictions)
+        path = self.disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, predictions)
+        os.replace(tmp_path, path)
+        with self.lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(size for _, size, _ in self.disk_entries())
+            else:
+                self.disk_bytes += os.path.getsize(path)
+            if self.disk_bytes > self.max_disk_bytes:
+                self.evict()
+
+    # Add to the in-memory tier, dropping the least recently used entry when full
+    def remember(self, key, predictions):
+        self.memory[key] = predictions
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def disk_entries(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for shard in os.scandir(self.cache_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.npy'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    # Remove least recently used files until the disk tier is back under 90% of its limit
+    def evict(self):
+        entries = sorted(self.disk_entries())
+        self.disk_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.disk_bytes <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_bytes -= size
+
+    def stats_text(self):
+        return f"Cache: {self.hits} hits / {self.misses} misses"
+
+cache_dir = DEFAULT_CACHE_DIR  # Set to None to disable the prediction cache
+cache_max_disk_mb = CACHE_MAX_DISK_MB
+
+def make_prediction_cache():
+    if cache_dir is None:
+        return None
+    return PredictionCache(cache_dir, max_disk_bytes=int(cache_max_disk_mb * (1 << 20)))
+
+# Runs in a decode worker (thread or process): hash the file for the prediction cache and
+# decode it, unless the cache already holds a prediction for it on disk.
+# Returns (cache key or None, file SHA-256 or None, 224x224 array or None, stage timings).
+def prepare_image(path, model_id=None, cache_root=None):
+    key = content_hash = None
+    timings = {}
+    if model_id is not None:
+        content_hash = file_sha256(path)
+        key = cache_key(content_hash, model_id)
+        if os.path.isfile(cache_file_path(cache_root, key)):
+            return key, content_hash, None, timings
+    return key, content_hash, load_image_array(path, timings), timings
+
+# Decodes and resizes images in a pool of worker threads or processes, ahead of the model.
+# With workers=0 images are decoded inline when submitted.
+class DecodePipeline:
+    def __init__(self, workers=DEFAULT_DECODE_WORKERS, use_processes=False, cache=None):
+        self.cache = cache
+        self.executor = None
+        if workers > 0:
+            if use_processes:
+                # Spawn rather than fork: forking a process that has TensorFlow loaded can deadlock
+                self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode')
+
+    # Start preparing files; returns a list of (path, future)
+    def submit(self, paths):
+        model_id = model_identity if self.cache is not None else None
+        cache_root = self.cache.cache_dir if self.cache is not None else None
+        prepared = []
+        for path in paths:
+            if self.executor is not None:
+                future = self.executor.submit(prepare_image, path, model_id, cache_root)
+            else:
+                future = Future()
+                try:
+                    future.set_result(prepare_image(path, model_id, cache_root))
+                except Exception as e:
+                    future.set_exception(e)
+            prepared.append((path, future))
+        return prepared
+
+    # Yield batches of (path, future), keeping `prefetch` batches decoding ahead of the
+    # one being returned, so at most (prefetch + 1) * batch_size decoded images are in memory
+    def batches(self, paths, batch_size, prefetch=PREFETCH_BATCHES):
+        window = deque()
+        position = 0
+        while position < len(paths) or window:
+            while position < len(paths) and len(window) <= prefetch:
+                window.append(self.submit(paths[position:position + batch_size]))
+                position += batch_size
+            yield window.popleft()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+decode_workers = DEFAULT_DECODE_WORKERS  # Set to 0 to decode on the inference thread
+decode_processes = False  # Decode in worker processes instead of threads
+
+def make_decode_pipeline(cache=None):
+    return DecodePipeline(decode_workers, decode_processes, cache)
+
+# Run one predict call on a batch of prepared files (see DecodePipeline.submit);
+# cache hits skip decode and inference. Returns [(path, decoded_predictions or exception)] in input order.
+# Stage timings go to latency_stats and, summed over the batch, into `timings` if given.
+# With content_hashes (a dict), the file hashes computed for the cache are added to it for the results store.
+def classify_prepared(model, prepared, top=5, cache=None, timings=None, content_hashes=None):
+    results = {}  # path -> predictions or exception
+    keys = {}
+    misses = []
+    arrays = []
+    batch_timings = {}
+    for path, future in prepared:
+        try:
+            key, content_hash, array, image_timings = future.result()
+            latency_stats.record_all(image_timings)
+            for stage, seconds in image_timings.items():
+                batch_timings[stage] = batch_timings.get(stage, 0.0) + seconds
+            if cache is not None:
+                keys[path] = key
+                if content_hashes is not None:
+                    content_hashes[path] = content_hash
+                cached = cache.get(key)
+                if cached is not None:
+                    results[path] = cached
+                    continue
+            if array is None:
+                array = load_image_array(path, batch_timings)  # Evicted from the cache since it was checked
+            arrays.append(array)
+            misses.append(path)
+        except Exception as e:
+            results[path] = e
+    if arrays:
+        model_timings = {}
+        with timed(model_timings, 'preprocess'):
+            batch = preprocess_input(np.stack(arrays))
+        with timed(model_timings, 'predict'):
+            predictions = model.predict(batch, batch_size=len(arrays), verbose=0)
+        latency_stats.record_all(model_timings, count=len(arrays))
+        for stage, seconds in model_timings.items():
+            batch_timings[stage] = batch_timings.get(stage, 0.0) + seconds
+        for path, prediction in zip(misses, predictions):
+            results[path] = prediction
+            if cache is not None:
+                cache.put(keys[path], prediction)
+    output = []
+    decode_timings = {}
+    with timed(decode_timings, 'decode_predictions'):
+        for path, _ in prepared:
+            result = results[path]
+            if not isinstance(result, Exception):
+                result = decode_predictions(result[np.newaxis], top=top)[0]
+            output.append((path, result))
+    latency_stats.record_all(decode_timings, count=len(prepared))
+    batch_timings.update(decode_timings)
+    if timings is not None:
+        timings.update(batch_timings)
+    return output
+
+# Classify many files with one predict call per batch while the pipeline decodes the next batches.
+# Yields (path, decoded_predictions) per file in input order, or (path, exception) if the file could not be read.
+def classify_files(model, paths, batch_size=DEFAULT_BATCH_SIZE, top=5, cache=None, pipeline=None):
+    batch_size = max(1, int(batch_size))
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = make_decode_pipeline(cache)
+    try:
+        for prepared in pipeline.batches(paths, batch_size):
+            yield from classify_prepared(model, prepared, top, cache)
+    finally:
+        if own_pipeline:
+            pipeline.close()
+
+# Model that outputs the pooled penultimate-layer features of EfficientNetB0
+def build_embedding_model(model):
+    if not hasattr(model, 'get_layer'):
+        raise ValueError("Embeddings need the keras backend")
+    return tf.keras.Model(model.inputs, model.get_layer(EMBEDDING_LAYER).output)
+
+# On-disk similarity index. Embeddings are L2-normalized and appended as float16 rows to one
+# flat file that is memory-mapped for queries, so only one chunk of rows is in RAM at a time.
+# A sidecar JSON-lines file holds [path, size, mtime] for every row; a path that is re-indexed
+# after it changed gets a new row and its older rows are ignored.
+# An index built with another model is only replaced when opened for indexing (rebuild=True);
+# opening it for a query raises ValueError instead.
+class EmbeddingIndex:
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, model_id=None, rebuild=False):
+        self.index_dir = index_dir
+        self.matrix_path = os.path.join(index_dir, 'embeddings.f16')
+        self.paths_path = os.path.join(index_dir, 'paths.jsonl')
+        self.meta_path = os.path.join(index_dir, 'meta.json')
+        self.dim = None
+        self.entries = []  # [path, size, mtime] per row
+        self.latest = {}  # path -> newest row
+        os.makedirs(index_dir, exist_ok=True)
+        if os.path.isfile(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if model_id is not None and meta['model'] != model_id:
+                # Embeddings from another model are not comparable
+                if not rebuild:
+                    raise ValueError(f"the index in {index_dir} was built with a different model ({meta['model']}), "
+                                     f"re-index with --index FOLDER")
+                print(f"Index in {index_dir} was built with another model, starting a new one")
+                self.clear()
+            else:
+                self.dim = meta['dim']
+                self.load_entries()
+
+    def clear(self):
+        for path in (self.matrix_path, self.paths_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load_entries(self):
+        if os.path.isfile(self.paths_path):
+            with open(self.paths_path) as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        break  # Partly written last line
+        rows = os.path.getsize(self.matrix_path) // (self.dim * 2) if os.path.isfile(self.matrix_path) else 0
+        # An interrupted append can leave the two files out of step; keep only complete rows
+        count = min(rows, len(self.entries))
+        if count < rows:
+            with open(self.matrix_path, 'r+b') as f:
+                f.truncate(count * self.dim * 2)
+        if count < len(self.entries):
+            self.entries = self.entries[:count]
+            with open(self.paths_path, 'w') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in self.entries)
+        self.latest = {os.path.abspath(entry[0]): row for row, entry in enumerate(self.entries)}
+
+    def __len__(self):
+        return len(self.latest)
+
+    # True if the file is not in the index or has changed since it was indexed.
+    # Rows are keyed by absolute path, so relative and absolute spellings share one row.
+    def needs_indexing(self, path):
+        row = self.latest.get(os.path.abspath(path))
+        if row is None:
+            return True
+        stat = os.stat(path)
+        return self.entries[row][1:] != [stat.st_size, stat.st_mtime]
+
+    def append(self, paths, embeddings, model_id):
+        embeddings = np.array(embeddings, dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(self.meta_path, 'w') as f:
+                json.dump({'dim': self.dim, 'model': model_id, 'dtype': 'float16'}, f)
+        # Rows are written before their paths, so a crash never leaves a path without its row
+        with open(self.matrix_path, 'ab') as f:
+            f.write(embeddings.astype(np.float16).tobytes())
+        with open(self.paths_path, 'a') as f:
+            for path in paths:
+                stat = os.stat(path)
+                path = os.path.abspath(path)
+                entry = [path, stat.st_size, stat.st_mtime]
+                self.latest[path] = len(self.entries)
+                self.entries.append(entry)
+                f.write(json.dumps(entry) + "\n")
+
+    # Cosine nearest neighbours of one embedding: [(path, similarity)], best first
+    def query(self, embedding, top=10):
+        count = len(self.entries)
+        if count == 0:
+            return []
+        query = np.array(embedding, dtype=np.float32).ravel()
+        query /= max(np.linalg.norm(query), 1e-12)
+        live = np.zeros(count, dtype=bool)
+        live[list(self.latest.values())] = True
+        matrix = np.memmap(self.matrix_path, dtype=np.float16, mode='r', shape=(count, self.dim))
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, count, QUERY_CHUNK_ROWS):
+            scores = matrix[start:start + QUERY_CHUNK_ROWS].astype(np.float32) @ query
+            scores[~live[start:start + QUERY_CHUNK_ROWS]] = -np.inf
+            rows = np.arange(start, start + len(scores))
+            # Keep only the running top candidates
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > top:
+                keep = np.argpartition(-best_scores, top)[:top]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [(self.entries[best_rows[i]][0], float(best_scores[i])) for i in order if np.isfinite(best_scores[i])][:top]
+
+index_dir = DEFAULT_INDEX_DIR  # Similarity index used by --index, --similar and Find Similar
+
+# Embedding extractor and the identity its index is built under. The index always holds
+# EfficientNetB0 embeddings (EMBEDDING_LAYER is B0's), whatever tier or backend is loaded for
+# classification, and building it leaves the loaded model's identity unchanged.
+def build_embedding_extractor():
+    global model_identity
+    identity = model_identity
+    model = build_model(MODEL_NAME)
+    embedding_identity = model_identity
+    model_identity = identity
+    return build_embedding_model(model), embedding_identity
+
+# Add new and changed images under a folder to the similarity index
+def index_folder(folder, batch_size=DEFAULT_BATCH_SIZE):
+    extractor, embedding_identity = build_embedding_extractor()
+    index = EmbeddingIndex(index_dir, embedding_identity, rebuild=True)
+    paths = [path for path in list_image_files(folder) if index.needs_indexing(path)]
+    print(f"Indexing {len(paths)} new or changed image(s), {len(index)} already indexed")
+    pipeline = make_decode_pipeline()
+    try:
+        for prepared in pipeline.batches(paths, max(1, int(batch_size))):
+            batch_paths = []
+            arrays = []
+            for path, future in prepared:
+                try:
+                    arrays.append(future.result()[2])
+                    batch_paths.append(path)
+                except Exception as e:
+                    print(f"{path}\tERROR: {e}")
+            if arrays:
+                embeddings = extractor.predict(preprocess_input(np.stack(arrays)), batch_size=len(arrays), verbose=0)
+                index.append(batch_paths, embeddings, embedding_identity)
+    finally:
+        pipeline.close()
+    print(f"Index now holds {len(index)} image(s) in {index_dir}")
+    return 0
+
+# Print the images most similar to one image
+def find_similar(image_path, top=10):
+    extractor, embedding_identity = build_embedding_extractor()
+    try:
+        index = EmbeddingIndex(index_dir, embedding_identity)
+    except ValueError as e:
+        print(f"Cannot search: {e}")
+        return 1
+    embedding = extractor(preprocess_image(image_path), training=False)
+    for path, similarity in index.query(np.asarray(embedding)[0], top):
+        print(f"{similarity:.4f}\t{path}")
+    return 0
+
+# Animated GIFs are classified as clips rather than by their first frame
+def is_clip(path):
+    return os.path.isdir(path) or path.lower().endswith(CLIP_EXTENSIONS)
+
+# Frame files of a numbered image sequence, ordered by the last number in their names
+def sequence_frame_paths(folder):
+    def frame_number(name):
+        numbers = re.findall(r'\d+', name)
+        return (int(numbers[-1]) if numbers else -1, name)
+    names = [name for name in os.listdir(folder) if name.lower().endswith(SUPPORTED_EXTENSIONS)]
+    return [os.path.join(folder, name) for name in sorted(names, key=frame_number)]
+
+# RGB frames of a clip, decoded one at a time: an animated GIF, or a folder of numbered frames
+def iter_clip_frames(source):
+    if os.path.isdir(source):
+        for path in sequence_frame_paths(source):
+            yield open_image(path, IMAGE_SIZE)
+        return
+    with Image.open(source) as clip:
+        for frame in ImageSequence.Iterator(clip):
+            yield frame.convert('RGB')
+
+# Decides which frames of a clip are classified: every Nth frame, or with scene_threshold set,
+# each frame whose small grayscale signature differs from the last sampled one by more than
+# scene_threshold (mean absolute difference, 0-1). The first frame is always sampled.
+class FrameSampler:
+    def __init__(self, every=CLIP_SAMPLE_EVERY, scene_threshold=None):
+        self.every = max(1, int(every))
+        self.scene_threshold = scene_threshold
+        self.last_signature = None
+        self.frames_seen = 0
+
+    def take(self, frame):
+        number = self.frames_seen
+        self.frames_seen += 1
+        if self.scene_threshold is None:
+            return number % self.every == 0
+        signature = np.asarray(frame.convert('L').resize(SCENE_SIGNATURE_SIZE), dtype=np.float32) / 255
+        if self.last_signature is not None and np.abs(signature - self.last_signature).mean() <= self.scene_threshold:
+            return False
+        self.last_signature = signature
+        return True
+
+clip_every = CLIP_SAMPLE_EVERY  # Classify every Nth frame of a clip
+scene_threshold = None  # Sample on scene changes instead when set
+
+def make_frame_sampler():
+    return FrameSampler(clip_every, scene_threshold)
+
+# Classify a clip by streaming its sampled frames through the model in batches and averaging
+# the predictions; only one batch of frames is held in memory. Returns
+# (decoded predictions of the mean, frames sampled, frames in the clip).
+def classify_clip(model, source, batch_size=DEFAULT_BATCH_SIZE, top=5, sampler=None):
+    sampler = sampler or make_frame_sampler()
+    batch_size = max(1, int(batch_size))
+    totals = None
+    sampled = 0
+    batch = []
+
+    def predict_batch():
+        nonlocal totals
+        predictions = model.predict(preprocess_input(np.stack(batch)), batch_size=len(batch), verbose=0)
+        summed = np.asarray(predictions, dtype=np.float64).sum(axis=0)
+        totals = summed if totals is None else totals + summed
+        batch.clear()
+
+    for frame in iter_clip_frames(source):
+        if sampler.take(frame):
+            batch.append(np.array(frame.resize(IMAGE_SIZE)))
+            sampled += 1
+            if len(batch) == batch_size:
+                predict_batch()
+    if batch:
+        predict_batch()
+    if not sampled:
+        raise ValueError(f"no frames found in {source}")
+    mean = (totals / sampled).astype(np.float32)
+    return decode_predictions(mean[np.newaxis], top=top)[0], sampled, sampler.frames_seen
+
+# Classify animated GIFs and numbered frame sequences (folders), one line per clip
+def run_clips(sources, batch_size=DEFAULT_BATCH_SIZE, top=5):
+    model = build_backend()
+    store = make_results_store()
+    try:
+        for source in sources:
+            try:
+                decoded, sampled, frames = classify_clip(model, source, batch_size, top)
+            except Exception as e:
+                print_result(source, e)
+                continue
+            print(f"{source}\t" + "\t".join(format_predictions(decoded)) + f"\t({sampled} of {frames} frames sampled)", flush=True)
+            if store is not None and not os.path.isdir(source):
+                store.add_many([(source, decoded)])
+    finally:
+        if store is not None:
+            store.close()
+    return 0
+
+# dHash: 64-bit gradient hash of a 9x8 grayscale thumbnail. Resized, re-encoded and burst
+# copies of a photo differ in only a few bits.
+def dhash(path):
+    img = open_image(path, DHASH_THUMBNAIL).convert('L').resize(DHASH_THUMBNAIL, Image.BILINEAR)
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+# Runs in a decode worker; unreadable files get no hash and are never treated as duplicates
+def dhash_or_none(path):
+    try:
+        return dhash(path)
+    except Exception:
+        return None
+
+# Finds a stored hash within max_distance bits of a new one. The 64 bits are split into
+# max_distance + 1 bands; two hashes that close must agree exactly on at least one band,
+# so only hashes sharing a band are compared.
+class HammingIndex:
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        edges = [64 * i // bands for i in range(bands + 1)]
+        self.bands = [(low, (1 << (high - low)) - 1) for low, high in zip(edges, edges[1:])]
+        self.tables = [{} for _ in self.bands]
+
+    def find(self, value):
+        for (shift, mask), table in zip(self.bands, self.tables):
+            for other, item in table.get((value >> shift) & mask, ()):
+                if (value ^ other).bit_count() <= self.max_distance:
+                    return item
+        return None
+
+    def add(self, value, item):
+        for (shift, mask), table in zip(self.bands, self.tables):
+            table.setdefault((value >> shift) & mask, []).append((value, item))
+
+dedup_distance = None  # Hamming distance for near-duplicate reuse; None disables the pre-pass
+
+# Perceptual-hash pre-pass. Returns (representatives, duplicates): representatives keeps the input
+# order and is what gets classified; duplicates maps a representative to the files reusing its prediction.
+def group_near_duplicates(paths, max_distance, pipeline=None):
+    max_distance = min(max(0, int(max_distance)), 63)
+    if pipeline is not None and pipeline.executor is not None:
+        hashes = pipeline.executor.map(dhash_or_none, paths, chunksize=64)
+    else:
+        hashes = map(dhash_or_none, paths)
+    index = HammingIndex(max_distance)
+    representatives = []
+    duplicates = {}
+    for path, value in zip(paths, hashes):
+        representative = index.find(value) if value is not None else None
+        if representative is None:
+            representatives.append(path)
+            if value is not None:
+                index.add(value, path)
+        else:
+            duplicates.setdefault(representative, []).append(path)
+    return representatives, duplicates
+
+def dedup_report(total, duplicates):
+    saved = sum(len(files) for files in duplicates.values())
+    return f"Near-duplicates: {saved} of {total} files reused a prediction ({saved} model invocations saved)"
+
+# Write one JSON object per line to the stats file
+def write_stats_line(stats_file, record):
+    if stats_file is not None:
+        stats_file.write(json.dumps(record) + "\n")
+        stats_file.flush()
+
+# Classification results in a local SQLite database: one row per (path, model) with the top-1
+# label and confidence, and every top-k label in a side table. The (label, confidence) indexes make
+# "top-1 is X with confidence > Y" a range scan. The connection is shared by the GUI and the
+# inference worker, so access is serialised with a lock.
+class ResultsStore:
+    def __init__(self, db_path=DEFAULT_RESULTS_DB):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS results (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    classified_at REAL NOT NULL,
+                    top1_label TEXT NOT NULL,
+                    top1_confidence REAL NOT NULL,
+                    UNIQUE (path, model)
+                );
+                CREATE TABLE IF NOT EXISTS labels (
+                    result_id INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    label TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    PRIMARY KEY (result_id, rank)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS results_top1 ON results (top1_label, top1_confidence);
+                CREATE INDEX IF NOT EXISTS labels_label ON labels (label, confidence);
+            """)
+            # Version 1: labels are stored normalized, as queries look them up
+            if self.db.execute("PRAGMA user_version").fetchone()[0] < 1:
+                self.db.execute("UPDATE results SET top1_label = replace(lower(top1_label), ' ', '_')")
+                self.db.execute("UPDATE labels SET label = replace(lower(label), ' ', '_')")
+                self.db.execute("PRAGMA user_version = 1")
+
+    # Store [(path, decoded_predictions or exception)] in one transaction; errors are skipped.
+    # A file classified again by the same model replaces its earlier row. The content hash is the
+    # file's SHA-256; pass the hashes already computed for the prediction cache as content_hashes
+    # ({path: hash}) so files are not read again, missing ones are hashed here.
+    def add_many(self, results, model_id=None, content_hashes=None):
+        model_id = model_id or model_identity or MODEL_NAME
+        now = time.time()
+        rows = []
+        for path, result in results:
+            if isinstance(result, Exception) or not len(result):
+                continue
+            digest = content_hashes.get(path) if content_hashes else None
+            if digest is None:
+                try:
+                    digest = file_sha256(path)
+                except OSError:
+                    continue
+            rows.append((os.path.abspath(path), digest, [(normalize_label(label), float(confidence)) for _, label, confidence in result]))
+        if not rows:
+            return 0
+        with self.lock, self.db:
+            for path, digest, labels in rows:
+                old = self.db.execute("SELECT id FROM results WHERE path = ? AND model = ?", (path, model_id)).fetchone()
+                if old is not None:
+                    self.db.execute("DELETE FROM labels WHERE result_id = ?", old)
+                    self.db.execute("DELETE FROM results WHERE id = ?", old)
+                result_id = self.db.execute(
+                    "INSERT INTO results (path, content_hash, model, classified_at, top1_label, top1_confidence) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, digest, model_id, now, labels[0][0], labels[0][1])).lastrowid
+                self.db.executemany("INSERT INTO labels (result_id, rank, label, confidence) VALUES (?, ?, ?, ?)",
+                                    [(result_id, rank, label, confidence) for rank, (label, confidence) in enumerate(labels, 1)])
+        return len(rows)
+
+    # Images whose top-1 label (or any stored label with any_rank) is `label` with confidence
+    # above min_confidence, most confident first. Returns [(path, confidence, classified_at)].
+    def query(self, label, min_confidence=0.0, limit=100, any_rank=False):
+        label = normalize_label(label)
+        if any_rank:
+            sql = ("SELECT results.path, MAX(labels.confidence), results.classified_at FROM labels"
+                   " JOIN results ON results.id = labels.result_id"
+                   " WHERE labels.label = ? AND labels.confidence > ?"
+                   " GROUP BY results.path ORDER BY MAX(labels.confidence) DESC LIMIT ?")
+        else:
+            sql = ("SELECT path, top1_confidence, classified_at FROM results"
+                   " WHERE top1_label = ? AND top1_confidence > ? ORDER BY top1_confidence DESC LIMIT ?")
+        with self.lock:
+            return self.db.execute(sql, (label, min_confidence, limit)).fetchall()
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    # Newest stored top-1 (label, confidence) for each of the given paths that has one
+    def top1(self, paths, chunk=500):
+        labels = {}
+        absolute = {os.path.abspath(path): path for path in paths}
+        keys = list(absolute)
+        with self.lock:
+            for start in range(0, len(keys), chunk):
+                part = keys[start:start + chunk]
+                rows = self.db.execute(
+                    f"SELECT path, top1_label, top1_confidence FROM results WHERE path IN ({','.join('?' * len(part))})"
+                    " ORDER BY classified_at", part)
+                for path, label, confidence in rows:
+                    labels[absolute[path]] = (label, confidence)
+        return labels
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+# Labels are stored as decode_predictions returns them ("golden_retriever")
+def normalize_label(label):
+    return label.strip().lower().replace(' ', '_')
+
+results_db = DEFAULT_RESULTS_DB  # None disables the results store
+
+def make_results_store():
+    if results_db is None:
+        return None
+    try:
+        return ResultsStore(results_db)
+    except sqlite3.Error as e:
+        print(f"Results store unavailable ({e}), results will not be saved")
+        return None
+
+# Print the stored images matching a label query
+def query_results(label, min_confidence=0.0, limit=100, any_rank=False):
+    store = ResultsStore(results_db)
+    start = time.perf_counter()
+    rows = store.query(label, min_confidence, limit, any_rank)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for path, confidence, classified_at in rows:
+        print(f"{path}\t{confidence*100:.2f}%\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(classified_at))}")
+    print(f"{len(rows)} match(es) for {normalize_label(label)!r} above {min_confidence*100:.1f}% in {elapsed_ms:.1f} ms "
+          f"({store.count()} stored result(s))", file=sys.stderr)
+    store.close()
+    return 0
+
+# A representative's result followed by its near-duplicates with the same result
+def with_duplicates(results, duplicates):
+    for path, result in results:
+        yield path, result
+        for duplicate in duplicates.get(path, ()):
+            yield duplicate, result
+
+# One tab-separated line of headless output
+def print_result(path, result, duplicate_of=None):
+    if isinstance(result, Exception):
+        line = f"{path}\tERROR: {result}"
+    else:
+        line = f"{path}\t" + "\t".join(format_predictions(result))
+    if duplicate_of is not None:
+        line += f"\t(near-duplicate of {duplicate_of})"
+    print(line, flush=True)
+
+# Headless folder classification: results are streamed to stdout as each batch finishes.
+# With stats_path ('-' for stderr), per-batch stage timings and a final percentile summary are written as JSON lines.
+def run_headless_folder(folder, batch_size=DEFAULT_BATCH_SIZE, top=5, stats_path=None):
+    all_paths = list_image_files(folder)
+    if not all_paths:
+        print(f"No PNG/JPG/JPEG files found in {folder}")
+        return 1
+    model = build_backend()
+    cache = make_prediction_cache()
+    pipeline = make_decode_pipeline(cache)
+    store = make_results_store()
+    paths, duplicates = all_paths, {}
+    if dedup_distance is not None:
+        paths, duplicates = group_near_duplicates(all_paths, dedup_distance, pipeline)
+    stats_file = None
+    if stats_path == '-':
+        stats_file = sys.stderr
+    elif stats_path:
+        stats_file = open(stats_path, 'a')
+    try:
+        for prepared in pipeline.batches(paths, max(1, int(batch_size))):
+            timings = {}
+            start = time.perf_counter()
+            keys = {}
+            results = classify_prepared(model, prepared, top, cache, timings, keys)
+            for path, result in results:
+                print_result(path, result)
+                for duplicate in duplicates.get(path, ()):
+                    print_result(duplicate, result, path)
+            if store is not None:
+                store.add_many(with_duplicates(results, duplicates), content_hashes=keys)
+            write_stats_line(stats_file, {'event': 'batch', 'time': time.time(), 'files': len(prepared),
+                                          'wall_ms': round((time.perf_counter() - start) * 1000, 2),
+                                          'stages_ms': {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}})
+        write_stats_line(stats_file, {'event': 'summary', 'time': time.time(), 'files': len(all_paths), 'stages': latency_stats.summary()})
+    finally:
+        pipeline.close()
+        if store is not None:
+            store.close()
+        if stats_file is not None and stats_file is not sys.stderr:
+            stats_file.close()
+    if cache is not None:
+        print(cache.stats_text())
+    if isinstance(model, CascadeModel):
+        print(model.stats_text())
+    if dedup_distance is not None:
+        print(dedup_report(len(all_paths), duplicates))
+    return 0
+
+# Append-only record of the files watch mode has classified, keyed by path, size and mtime.
+# Later lines win, so a changed file is simply recorded again.
+class WatchManifest:
+    def __init__(self, path):
+        self.path = path
+        self.done = {}  # path -> [size, mtime_ns]
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Partly written last line
+                    self.done[os.path.abspath(entry['path'])] = [entry['size'], entry['mtime_ns']]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a')
+
+    def __len__(self):
+        return len(self.done)
+
+    # Paths are kept absolute, so the same folder watched by relative and absolute path shares entries
+    def is_done(self, path, size, mtime_ns):
+        return self.done.get(os.path.abspath(path)) == [size, mtime_ns]
+
+    def record(self, path, size, mtime_ns, result):
+        path = os.path.abspath(path)
+        entry = {'path': path, 'size': size, 'mtime_ns': mtime_ns, 'time': time.time()}
+        if isinstance(result, Exception):
+            entry['error'] = str(result)
+        else:
+            entry['predictions'] = [[label, round(float(confidence), 6)] for _, label, confidence in result]
+        self.file.write(json.dumps(entry) + "\n")
+        self.done[path] = [size, mtime_ns]
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+# Each manifest belongs to one watched folder
+def default_manifest_path(folder):
+    digest = hashlib.sha256(os.path.abspath(folder).encode()).hexdigest()[:16]
+    return os.path.join(DEFAULT_MANIFEST_DIR, f"{os.path.basename(os.path.abspath(folder)) or 'root'}-{digest}.jsonl")
+
+# Finds new and replaced images under a folder. A poll costs one stat per directory: only
+# directories whose mtime changed (a file was added, removed or renamed in them) are listed again.
+# Files rewritten in place keep their directory's mtime and are not picked up.
+class FolderWatcher:
+    def __init__(self, folder):
+        self.folder = folder
+        self.dir_mtimes = {}  # directory -> mtime_ns when last listed
+        self.subdirs = {}  # directory -> its subdirectories
+        self.files = {}  # directory -> {path: (size, mtime_ns)}
+
+    # Returns [(path, size, mtime_ns)] of images that appeared or changed since the last poll
+    def poll(self):
+        changed = []
+        seen = set()
+        stack = [self.folder]
+        while stack:
+            directory = stack.pop()
+            seen.add(directory)
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            if self.dir_mtimes.get(directory) != mtime_ns:
+                self.dir_mtimes[directory] = mtime_ns
+                changed.extend(self.list_directory(directory))
+            stack.extend(self.subdirs.get(directory, ()))
+        for directory in set(self.dir_mtimes) - seen:
+            # Removed directories
+            for mapping in (self.dir_mtimes, self.subdirs, self.files):
+                mapping.pop(directory, None)
+        return changed
+
+    def list_directory(self, directory):
+        subdirs = []
+        files = {}
+        changed = []
+        previous = self.files.get(directory, {})
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            entries = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                    if previous.get(entry.path) != files[entry.path]:
+                        changed.append((entry.path, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                continue  # Removed while listing
+        self.subdirs[directory] = subdirs
+        self.files[directory] = files
+        return changed
+
+# Files whose mtime is this recent may still be being copied; they wait for a later poll.
+# Returns [(path, size, mtime_ns)] of the settled files and keeps the rest in `pending`.
+def settled_files(pending, settle_seconds=WATCH_SETTLE_SECONDS):
+    ready = []
+    now = time.time_ns()
+    for path, (size, mtime_ns) in list(pending.items()):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            del pending[path]
+            continue
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            pending[path] = (stat.st_size, stat.st_mtime_ns)
+        elif now - mtime_ns >= settle_seconds * 1e9:
+            ready.append((path, size, mtime_ns))
+            del pending[path]
+    return sorted(ready)
+
+manifest_path = None  # Watch-mode manifest; None picks one under DEFAULT_MANIFEST_DIR
+
+# Watch mode: classify images as they arrive in a folder, recording each in the manifest so a
+# restart resumes where it stopped. With once=True, classify the backlog and return.
+def run_watch(folder, batch_size=DEFAULT_BATCH_SIZE, top=5, interval=WATCH_INTERVAL, once=False):
+    if not os.path.isdir(folder):
+        print(f"{folder} is not a directory")
+        return 1
+    manifest = WatchManifest(manifest_path or default_manifest_path(folder))
+    watcher = FolderWatcher(folder)
+    model = build_backend()
+    cache = make_prediction_cache()
+    pipeline = make_decode_pipeline(cache)
+    store = make_results_store()
+    pending = {}  # path -> (size, mtime_ns) waiting to settle
+    print(f"Watching {folder}: {len(manifest)} file(s) already classified (manifest {manifest.path})", flush=True)
+    try:
+        while True:
+            for path, size, mtime_ns in watcher.poll():
+                if not manifest.is_done(path, size, mtime_ns):
+                    pending[path] = (size, mtime_ns)
+            ready = settled_files(pending, 0 if once else WATCH_SETTLE_SECONDS) if pending else []
+            stamps = {path: (size, mtime_ns) for path, size, mtime_ns in ready}
+            for prepared in pipeline.batches([path for path, _, _ in ready], max(1, int(batch_size))):
+                keys = {}
+                results = classify_prepared(model, prepared, top, cache, content_hashes=keys)
+                for path, result in results:
+                    print_result(path, result)
+                    manifest.record(path, *stamps[path], result)
+                if store is not None:
+                    store.add_many(results, content_hashes=keys)
+                manifest.flush()
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        pipeline.close()
+        manifest.close()
+        if store is not None:
+            store.close()
+    print(f"Manifest holds {len(manifest)} classified file(s)")
+    return 0
+
+# Module settings a sharded worker needs; spawned processes start from the defaults
+def shard_settings(use_cache=True):
+    return {'model_store_dir': model_store_dir, 'inference_backend': inference_backend, 'model_tier': model_tier,
+            'latency_budget_ms': latency_budget_ms, 'cascade_threshold': cascade_threshold,
+            'tflite_threads': tflite_threads, 'calibration_dir': calibration_dir,
+            'cache_dir': cache_dir if use_cache else None, 'cache_max_disk_mb': cache_max_disk_mb}
+
+shard_model = None  # Model loaded once per sharded worker process
+shard_cache = None
+shard_pipeline = None
+
+# Initializer of a sharded worker process: pin the thread pools, then load the model once.
+# With a barrier, wait until every worker has loaded so benchmarks time inference only.
+def init_shard_worker(settings, intra_op_threads, inter_op_threads, barrier=None):
+    global shard_model, shard_cache, shard_pipeline
+    globals().update(settings)
+    # Also caps the OpenMP/oneDNN pools, which read these before TensorFlow starts
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    load_tensorflow()
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    if settings['inference_backend'] != 'keras' and settings['tflite_threads'] is None:
+        globals()['tflite_threads'] = intra_op_threads
+    shard_model = build_backend()
+    shard_cache = make_prediction_cache()
+    shard_pipeline = DecodePipeline(0, cache=shard_cache)  # The worker process is the unit of parallelism
+    if barrier is not None:
+        try:
+            barrier.wait(timeout=SHARD_STARTUP_TIMEOUT)
+        except threading.BrokenBarrierError:
+            pass
+
+# Runs in a sharded worker: classify one batch. Returns (results, model identity, cache keys,
+# start time, end time); the parent never loads a model, so it stores results under the worker's identity.
+def classify_shard(paths, top=5):
+    start = time.time()
+    keys = {}
+    results = classify_prepared(shard_model, shard_pipeline.submit(paths), top, shard_cache, content_hashes=keys)
+    return results, model_identity, keys, start, time.time()
+
+# Runs in the parent before the shard workers start: resolve the tier and make sure the serialized
+# models, class index, tier benchmarks and TFLite file the workers load already exist, so the workers
+# never build or convert the same artifact at once. Returns settings pinning the workers to the tier.
+def prepare_shard_artifacts():
+    tier = resolve_tier()
+    tiers = [tier]
+    if cascade_threshold is not None:
+        tiers.append(min(MODEL_TIERS, key=load_tier_benchmarks().get))
+    identity = f'{tier}-imagenet'
+    if model_store_dir is not None:
+        for name in tiers:
+            store = ModelStore(model_store_dir, name)
+            if not store.is_intact():
+                load_tensorflow()
+                print(f"Building {name} in {model_store_dir} before starting the workers", flush=True)
+                store.load_or_build()
+            if not os.path.isfile(store.class_index_path):
+                load_tensorflow()
+                store.load_decoder()
+            if name == tier:
+                identity = f'{tier}-{store.checksum}'
+    if inference_backend != 'keras' and cascade_threshold is None:
+        path = tflite_path(inference_backend, identity)
+        if not os.path.isfile(path):
+            print(f"Converting the model to {inference_backend} before starting the workers: {path}", flush=True)
+            convert_to_tflite(build_model(tier), inference_backend, path, calibration_dir)
+    return {'model_tier': tier, 'latency_budget_ms': None}
+
+def default_thread_split(workers):
+    return max(1, (os.cpu_count() or 1) // workers), 1
+
+# Classify `paths` in batches spread over `workers` processes. Yields classify_shard's tuple
+# per batch in input order, so the merged output is ordered whatever worker finishes first.
+def map_shards(paths, workers, intra_op_threads=None, inter_op_threads=None, batch_size=DEFAULT_BATCH_SIZE,
+               top=5, use_cache=True, wait_for_all=False):
+    workers = max(1, int(workers))
+    default_intra, default_inter = default_thread_split(workers)
+    intra_op_threads = intra_op_threads or default_intra
+    inter_op_threads = inter_op_threads or default_inter
+    batch_size = max(1, int(batch_size))
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    context = multiprocessing.get_context('spawn')  # Forking after TensorFlow is loaded can deadlock
+    barrier = context.Barrier(workers) if wait_for_all else None
+    settings = shard_settings(use_cache)
+    settings.update(prepare_shard_artifacts())
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_shard_worker,
+                             initargs=(settings, intra_op_threads, inter_op_threads, barrier)) as executor:
+        yield from executor.map(classify_shard, batches, itertools.repeat(top))
+
+# Sharded headless folder classification: same output as --folder, one model per worker process.
+# The near-duplicate pre-pass runs in this process, before the files are sharded.
+def run_sharded(folder, workers, intra_op_threads=None, inter_op_threads=None, batch_size=DEFAULT_BATCH_SIZE, top=5):
+    all_paths = list_image_files(folder)
+    if not all_paths:
+        print(f"No PNG/JPG/JPEG files found in {folder}")
+        return 1
+    paths, duplicates = all_paths, {}
+    if dedup_distance is not None:
+        pipeline = make_decode_pipeline()
+        try:
+            paths, duplicates = group_near_duplicates(all_paths, dedup_distance, pipeline)
+        finally:
+            pipeline.close()
+    store = make_results_store()
+    start = time.perf_counter()
+    try:
+        for results, identity, keys, _, _ in map_shards(paths, workers, intra_op_threads, inter_op_threads, batch_size, top):
+            for path, result in results:
+                print_result(path, result)
+                for duplicate in duplicates.get(path, ()):
+                    print_result(duplicate, result, path)
+            if store is not None:
+                store.add_many(with_duplicates(results, duplicates), identity, keys)
+    finally:
+        if store is not None:
+            store.close()
+    elapsed = time.perf_counter() - start
+    print(f"Classified {len(all_paths)} images with {workers} worker(s) in {elapsed:.1f} s ({len(all_paths) / elapsed:.1f} img/s)")
+    if dedup_distance is not None:
+        print(dedup_report(len(all_paths), duplicates))
+    return 0
+
+# Images per second of sharded classification for 1..max_workers processes, each with
+# cpu_count / workers intra-op threads, after every worker has loaded its model.
+# The prediction cache is off so repeated files are really classified.
+def benchmark_sharding(folder=None, max_workers=None, batch_size=DEFAULT_BATCH_SIZE, images=SHARD_BENCHMARK_IMAGES):
+    cpus = os.cpu_count() or 1
+    max_workers = max(1, max_workers or cpus)
+    counts = sorted({2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers} | {max_workers})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = list_image_files(folder) if folder else write_synthetic_photos(tmp_dir, [(1600, 1200)] * 16)
+        if not paths:
+            print(f"No PNG/JPG/JPEG files found in {folder}")
+            return 1
+        paths = list(itertools.islice(itertools.cycle(paths), max(images, len(paths))))
+        print(f"Sharded classification of {len(paths)} images on {cpus} CPU(s), batch size {batch_size}:")
+        print(f"{'workers':>8} {'intra':>6} {'inter':>6} {'img/s':>8} {'speedup':>8}")
+        results = []
+        for workers in counts:
+            intra, inter = default_thread_split(workers)
+            # Small enough that every worker gets batches
+            per_batch = max(1, min(batch_size, len(paths) // workers))
+            starts, ends = [], []
+            for _, _, _, start, end in map_shards(paths, workers, intra, inter, per_batch, use_cache=False, wait_for_all=True):
+                starts.append(start)
+                ends.append(end)
+            throughput = len(paths) / (max(ends) - min(starts))
+            results.append((throughput, workers, intra, inter))
+            print(f"{workers:>8} {intra:>6} {inter:>6} {throughput:>8.1f} {throughput / results[0][0]:>7.2f}x", flush=True)
+    best = max(results)
+    print(f"Best split on this machine: {best[1]} worker process(es) x {best[2]} intra-op thread(s) ({best[0]:.1f} img/s)")
+    return 0
+
+# Groups requests that arrive within max_wait_ms into one predict call of up to max_batch_size images
+class MicroBatcher:
+    def __init__(self, model, max_batch_size=SERVER_MAX_BATCH_SIZE, max_wait_ms=SERVER_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.stats = LatencyStats()  # queue_wait and predict latencies
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.images = 0
+        self.batches = 0
+        self.recent = deque()  # (finish time, batch size) over the last THROUGHPUT_WINDOW seconds
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Queue one 224x224 image; the returned Future resolves to its prediction vector
+    def submit(self, img_array):
+        future = Future()
+        self.requests.put((time.perf_counter(), img_array, future))
+        return future
+
+    # Batch sizes are padded to a power of two so the model only ever sees a few input shapes
+    # instead of being retraced for every new batch size
+    def bucket_size(self, count):
+        return min(self.max_batch_size, 1 << (count - 1).bit_length())
+
+    def predict(self, arrays):
+        batch = np.zeros((self.bucket_size(len(arrays)),) + IMAGE_SIZE + (3,), dtype=np.float32)
+        batch[:len(arrays)] = arrays
+        return self.model.predict(preprocess_input(batch), batch_size=len(batch), verbose=0)[:len(arrays)]
+
+    # Run every bucket size once before serving
+    def warm_up(self):
+        sizes = sorted({self.bucket_size(count) for count in range(1, self.max_batch_size + 1)})
+        for size in sizes:
+            self.predict(np.zeros((size,) + IMAGE_SIZE + (3,), dtype=np.uint8))
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = batch[0][0] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            start = time.perf_counter()
+            for enqueued, _, _ in batch:
+                self.stats.record('queue_wait', start - enqueued)
+            try:
+                predictions = self.predict([img_array for _, img_array, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.stats.record('predict', time.perf_counter() - start, count=len(batch))
+            for (_, _, future), prediction in zip(batch, predictions):
+                future.set_result((prediction, len(batch)))
+            with self.lock:
+                now = time.time()
+                self.images += len(batch)
+                self.batches += 1
+                self.recent.append((now, len(batch)))
+                while self.recent and self.recent[0][0] < now - THROUGHPUT_WINDOW:
+                    self.recent.popleft()
+
+    def metrics(self):
+        with self.lock:
+            now = time.time()
+            recent_images = sum(size for _, size in self.recent)
+            window = min(THROUGHPUT_WINDOW, now - self.started) or 1
+            return {'uptime_s': round(now - self.started, 1),
+                    'images': self.images,
+                    'batches': self.batches,
+                    'mean_batch_size': round(self.images / self.batches, 2) if self.batches else 0,
+                    'throughput_ips': round(recent_images / window, 2),
+                    'queue_depth': self.requests.qsize(),
+                    'max_batch_size': self.max_batch_size,
+                    'max_wait_ms': self.max_wait * 1000,
+                    'latency': self.stats.summary()}
+
+# HTTP API of the local inference service:
+#   POST /classify?top=K   body: raw image bytes, or JSON {"path": "/local/file.jpg"}
+#   GET  /metrics          throughput, batch sizes and queue latency
+#   GET  /health
+class ClassifierRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self.send_json(200, self.server.batcher.metrics())
+        elif path == '/health':
+            self.send_json(200, {'status': 'ok', 'model': model_identity})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/classify':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            top = int(parse_qs(url.query).get('top', [5])[0])
+        except ValueError:
+            top = 0
+        if top < 1:
+            self.send_json(400, {'error': 'top must be a positive integer'})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                source = json.loads(body)['path']
+            else:
+                source = io.BytesIO(body)
+            # Decoding happens on the request thread, so concurrent requests decode in parallel
+            img_array = load_image_array(source)
+        except Exception as e:
+            self.send_json(400, {'error': f'could not read image: {e}'})
+            return
+        try:
+            prediction, batch_size = self.server.batcher.submit(img_array).result()
+            decoded = decode_predictions(prediction[np.newaxis], top=top)[0]
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'predictions': [{'imagenet_id': imagenet_id, 'label': label, 'confidence': float(confidence)}
+                                             for imagenet_id, label, confidence in decoded],
+                             'batch_size': batch_size})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep stdout quiet under load
+
+# Headless local HTTP inference service sharing one loaded model between all clients
+def serve(host=SERVER_HOST, port=SERVER_PORT, max_batch_size=SERVER_MAX_BATCH_SIZE, max_wait_ms=SERVER_MAX_WAIT_MS):
+    model = build_backend()
+    server = ThreadingHTTPServer((host, port), ClassifierRequestHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(model, max_batch_size, max_wait_ms)
+    server.batcher.warm_up()
+    print(f"Serving {model_identity} on http://{host}:{port} (max batch {max_batch_size}, max wait {max_wait_ms} ms)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+# Measure click-to-result latency (decode, preprocess, inference, decode_predictions)
+# for model.predict and the compiled single-image paths
+def measure_latency(image_path=None, runs=20, top=5):
+    model = build_model()
+    variants = [
+        ('model.predict', lambda img_array: model.predict(img_array, verbose=0)),
+        ('tf.function', make_predict_fn(model)),
+        ('tf.function + XLA', make_predict_fn(model, jit_compile=True)),
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if image_path is None:
+            # Synthetic camera-sized photo so the decode cost is realistic
+            image_path = os.path.join(tmp_dir, 'synthetic.jpg')
+            noise = np.random.randint(0, 256, (1080, 1440, 3), dtype=np.uint8)
+            Image.fromarray(noise).save(image_path)
+
+        print(f"Click-to-result latency over {runs} runs ({image_path}):")
+        for name, predict in variants:
+            try:
+                start = time.perf_counter()
+                predict(preprocess_image(image_path))  # First call includes tracing/compilation
+                first_ms = (time.perf_counter() - start) * 1000
+                timings = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    predictions = np.asarray(predict(preprocess_image(image_path)))
+                    decode_predictions(predictions, top=top)
+                    timings.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                print(f"  {name:<18} failed: {e}")
+                continue
+            print(f"  {name:<18} first {first_ms:8.1f} ms   median {np.median(timings):7.1f} ms   p95 {np.percentile(timings, 95):7.1f} ms")
+    return 0
+
+# A unit of work for the inference worker
+class InferenceJob:
+    def __init__(self, kind, func, args, priority):
+        self.kind = kind  # 'image' or 'folder'
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.submitted = time.perf_counter()
+        self.cancelled = False
+
+# One long-lived thread that owns the model and runs jobs from a bounded priority queue.
+# Results are put on result_queue as (job, result) for the Tk main loop to poll,
+# so no Tk calls are made from the worker thread.
+class InferenceWorker:
+    def __init__(self, result_queue, max_pending=MAX_PENDING_JOBS):
+        self.result_queue = result_queue
+        self.jobs = queue.PriorityQueue(maxsize=max_pending)
+        self.sequence = itertools.count()  # Keeps submission order within a priority
+        self.lock = threading.Lock()
+        self.pending = []  # Jobs queued but not yet started
+        self.running = None  # Job currently being run
+        self.last_wait = 0.0  # Seconds the last started job spent queued
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Queue a job; raises queue.Full when the queue is at its bound
+    def submit(self, kind, func, *args, priority=PRIORITY_INTERACTIVE):
+        job = InferenceJob(kind, func, args, priority)
+        with self.lock:
+            self.jobs.put_nowait((priority, next(self.sequence), job))
+            self.pending.append(job)
+        return job
+
+    # Cancel queued jobs of one kind that have become stale
+    def cancel(self, kind):
+        with self.lock:
+            for job in self.pending:
+                if job.kind == kind:
+                    job.cancelled = True
+
+    # Number of live queued jobs, optionally of one kind
+    def count(self, kind=None):
+        with self.lock:
+            return sum(1 for job in self.pending if not job.cancelled and kind in (None, job.kind))
+
+    def depth(self):
+        return self.count()
+
+    def busy(self):
+        return self.running is not None or self.depth() > 0
+
+    def run(self):
+        while True:
+            _, _, job = self.jobs.get()
+            with self.lock:
+                self.pending.remove(job)
+                if job.cancelled:
+                    continue
+                self.running = job
+            self.last_wait = time.perf_counter() - job.submitted
+            try:
+                result = job.func(*job.args)
+            except Exception as e:
+                result = e
+            self.result_queue.put((job, result))
+            self.running = None
+
+# Loader animation frames, resized to `size` as RGBA, in one (frames, height, width, 4) uint8 array
+def render_loader_frames(gif_path, size=LOADER_FRAME_SIZE):
+    frames = []
+    with Image.open(gif_path) as loader_gif:
+        for frame in ImageSequence.Iterator(loader_gif):
+            frames.append(np.asarray(frame.copy().resize(size, Image.LANCZOS).convert('RGBA')))
+    return np.stack(frames)
+
+# Pre-rendered loader frames are cached as one .npy file named after the GIF's hash and the frame
+# size, so an edited loader.gif is rendered again and stale renders are removed.
+# Returns (frames array, True if it came from the cache).
+def load_loader_frames(gif_path, asset_dir=DEFAULT_ASSET_DIR, size=LOADER_FRAME_SIZE):
+    if asset_dir is None:
+        return render_loader_frames(gif_path, size), False
+    prefix = 'loader-'
+    cache_path = os.path.join(asset_dir, f"{prefix}{file_sha256(gif_path)[:16]}-{size[0]}x{size[1]}.npy")
+    if os.path.isfile(cache_path):
+        try:
+            return np.load(cache_path), True
+        except (OSError, ValueError):
+            pass  # Damaged cache file, render again
+    frames = render_loader_frames(gif_path, size)
+    os.makedirs(asset_dir, exist_ok=True)
+    for name in os.listdir(asset_dir):
+        if name.startswith(prefix) and name.endswith('.npy'):
+            os.remove(os.path.join(asset_dir, name))
+    tmp_path = cache_path + '.tmp.npy'
+    np.save(tmp_path, frames)
+    os.replace(tmp_path, cache_path)
+    return frames, False
+
+asset_dir = DEFAULT_ASSET_DIR  # None renders the loader frames on every launch
+
+# Startup-time breakdown: stage durations and milestones, in ms
+startup_timings = {}
+startup_marks = {}
+
+def mark_startup(event):
+    startup_marks[event] = (time.perf_counter() - STARTUP_BEGIN) * 1000
+
+def startup_report():
+    lines = ["Startup breakdown:"]
+    for stage, label in (('imports', 'imports'), ('window', 'window and widgets'), ('assets', 'loader frames'),
+                         ('tensorflow', 'TensorFlow import'), ('model', 'model load and warm-up')):
+        if stage in startup_timings:
+            lines.append(f"  {label:<24} {startup_timings[stage]:8.0f} ms")
+    for event, label in (('first_paint', 'first paint at'), ('model_ready', 'model ready at')):
+        if event in startup_marks:
+            lines.append(f"  {label:<24} {startup_marks[event]:8.0f} ms")
+    return "\n".join(lines)
+
+# Small RGB previews for the gallery. Recently used thumbnails stay in a bounded in-memory LRU;
+# all are also written as JPEGs to cache_dir, keyed by path, size and mtime, so reopening a
+# folder skips decoding the originals. load() runs on the gallery's decode threads.
+class ThumbnailCache:
+    def __init__(self, cache_dir=DEFAULT_THUMBNAIL_DIR, memory_entries=THUMBNAIL_MEMORY_ENTRIES, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.size = size
+        self.memory = OrderedDict()  # path -> PIL image, least recently used first
+        self.lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, path):
+        with self.lock:
+            image = self.memory.get(path)
+            if image is not None:
+                self.memory.move_to_end(path)
+            return image
+
+    def remember(self, path, image):
+        with self.lock:
+            self.memory[path] = image
+            self.memory.move_to_end(path)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def disk_path(self, path):
+        stat = os.stat(path)
+        key = hashlib.sha256(f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.size}'.encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.jpg')
+
+    def load(self, path):
+        image = self.get(path)
+        if image is not None:
+            return image
+        disk_path = self.disk_path(path) if self.cache_dir is not None else None
+        if disk_path is not None and os.path.isfile(disk_path):
+            with Image.open(disk_path) as cached:
+                image = cached.convert('RGB')
+        else:
+            image = ImageOps.contain(open_image(path, self.size), self.size)
+            if disk_path is not None:
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+                # Write then rename so a concurrent reader never sees a partial file
+                temp_path = f"{disk_path}.{threading.get_ident()}.tmp"
+                image.save(temp_path, format='JPEG', quality=85)
+                os.replace(temp_path, disk_path)
+        self.remember(path, image)
+        return image
+
+thumbnail_dir = DEFAULT_THUMBNAIL_DIR  # None keeps thumbnails in memory only
+
+# Scrollable grid of thumbnails with top-1 labels. The grid is virtual: only the cells in view
+# (plus a row of margin) have canvas items and PhotoImages, and they are dropped when scrolled
+# away, so memory stays flat however many images the folder holds. Thumbnails are decoded on
+# worker threads; queued decodes for cells that left the view are cancelled.
+class Gallery(tk.Toplevel):
+    def __init__(self, master, paths, labels=None, thumbnails=None):
+        super().__init__(master)
+        self.title(f"Gallery ({len(paths)} images)")
+        self.geometry("900x650")
+        self.paths = paths
+        self.labels = labels or {}  # path -> (label, confidence)
+        self.thumbnails = thumbnails or ThumbnailCache(thumbnail_dir)
+        self.executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+        self.ready = queue.Queue()  # (index, future) of finished decodes
+        self.cells = {}  # index -> (image item, text item) of cells in view
+        self.photos = {}  # index -> PhotoImage, only for cells in view
+        self.futures = {}  # index -> pending decode
+        self.columns = 1
+        self.closed = False
+
+        self.canvas = tk.Canvas(self, bg="#f0f0f0", highlightthickness=0, yscrollincrement=GALLERY_CELL[1] // 4)
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.scroll)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.canvas.bind('<Configure>', lambda event: self.layout())
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.canvas.bind(sequence, self.on_mousewheel)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.after(POLL_INTERVAL_MS, self.poll_thumbnails)
+
+    def layout(self):
+        columns = max(1, self.canvas.winfo_width() // GALLERY_CELL[0])
+        rows = -(-len(self.paths) // columns)
+        self.canvas.configure(scrollregion=(0, 0, columns * GALLERY_CELL[0], rows * GALLERY_CELL[1]))
+        if columns != self.columns:
+            # Every cell moves when the column count changes
+            self.columns = columns
+            for index in list(self.cells):
+                self.drop_cell(index)
+        self.refresh()
+
+    def scroll(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, 'units')
+        else:
+            self.canvas.yview_scroll(1, 'units')
+        self.refresh()
+
+    # Indices of the cells in view, with one row of margin above and below
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first_row = max(0, int(top // GALLERY_CELL[1]) - 1)
+        last_row = int(bottom // GALLERY_CELL[1]) + 1
+        return range(first_row * self.columns, min(len(self.paths), (last_row + 1) * self.columns))
+
+    def refresh(self):
+        visible = self.visible_range()
+        for index in list(self.cells):
+            if index not in visible:
+                self.drop_cell(index)
+        for index in visible:
+            if index not in self.cells:
+                self.add_cell(index)
+
+    def add_cell(self, index):
+        path = self.paths[index]
+        row, column = divmod(index, self.columns)
+        x = column * GALLERY_CELL[0] + GALLERY_CELL[0] // 2
+        y = row * GALLERY_CELL[1]
+        image_item = self.canvas.create_image(x, y + 4 + THUMBNAIL_SIZE[1] // 2)
+        label, confidence = self.labels.get(path, (None, None))
+        caption = os.path.basename(path)[:24]
+        if label is not None:
+            caption += f"\n{label.replace('_', ' ').title()[:24]} ({confidence*100:.0f}%)"
+        text_item = self.canvas.create_text(x, y + THUMBNAIL_SIZE[1] + 8, text=caption, anchor='n',
+                                            justify=tk.CENTER, font=("Helvetica", 9))
+        self.cells[index] = (image_item, text_item)
+        image = self.thumbnails.get(path)
+        if image is not None:
+            self.show_thumbnail(index, image)
+        else:
+            future = self.executor.submit(self.thumbnails.load, path)
+            self.futures[index] = future
+            future.add_done_callback(lambda done, index=index: self.ready.put((index, done)))
+
+    def drop_cell(self, index):
+        for item in self.cells.pop(index):
+            self.canvas.delete(item)
+        self.photos.pop(index, None)
+        future = self.futures.pop(index, None)
+        if future is not None:
+            future.cancel()
+
+    def show_thumbnail(self, index, image):
+        photo = ImageTk.PhotoImage(image)
+        self.photos[index] = photo
+        self.canvas.itemconfigure(self.cells[index][0], image=photo)
+
+    # Hand finished decodes to the canvas; results for cells that left the view are ignored
+    def poll_thumbnails(self):
+        if self.closed:
+            return
+        while True:
+            try:
+                index, future = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            if self.futures.get(index) is not future:
+                continue
+            del self.futures[index]
+            if future.cancelled() or future.exception() is not None:
+                self.canvas.itemconfigure(self.cells[index][1], fill="#aa0000")
+            else:
+                self.show_thumbnail(index, future.result())
+        self.after(POLL_INTERVAL_MS, self.poll_thumbnails)
+
+    def close(self):
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
+
 class ImageClassifier(tk.Tk):
+    top_k = 3  # Number of predictions shown per image
+    batch_size = DEFAULT_BATCH_SIZE  # Batch size used by folder classification
+    use_xla = False  # XLA-compile the single-image inference function
+    show_stats = False  # Show the per-stage latency panel at start-up
+    exit_after_startup = False  # Quit once the model is ready (for measuring startup time)
+
     def __init__(self):
         super().__init__()
         self.title("AI Image Classifier App")
         self.geometry("800x600")
         self.configure(bg="#f0f0f0")  # Change background color
         self.image_path = None  # Hidden variable that stores the image path
-        self.model = self.load_model()  # Load pre-trained model
-        self.loading_images = []  # List to hold frames of loading animation
+        self.predict_fn = None  # Compiled single-image inference function
+        self.click_time = None  # Time of the last Classify click, for latency reporting
+        self.model = None  # Pre-trained model, loaded in the background
+        self.model_queue = queue.Queue()  # Hands the loaded model (or error) to the GUI thread
+        self.loading_images = []  # PhotoImages of the loading animation, created as each frame is first shown
+        self.loader_frames = None  # Pre-rendered RGBA frames, loaded off the main thread
         self.animation_label = None  # Label to display the loading animation
         self.result_queue = queue.Queue()  # Queue to hold classification results
+        self.worker = InferenceWorker(self.result_queue)  # Long-lived thread that runs all inference
+        self.image_job = None  # Current single-image job
+        self.cache = make_prediction_cache()  # Content-addressed prediction cache (None if disabled)
+        self.pipeline = make_decode_pipeline(self.cache)  # Decodes queued folder batches ahead of the model
+        self.results_store = make_results_store()  # SQLite store behind the label search box (None if disabled)
+        self.thumbnails = None  # Gallery thumbnail cache, created with the first gallery
+        self.stats_label = None  # Per-stage latency panel, shown when "Show Stats" is ticked
+        self.embedding_model = None  # EfficientNetB0 feature extractor for Find Similar, built on first use
+        self.embedding_identity = None  # Model identity the similarity index is checked against
+        self.classification_running = False
+        self.folder_pending = []  # Folder files waiting to be submitted to the worker
+        self.folder_duplicates = {}
+        start = time.perf_counter()
         self.init_gui()  # Initialize user interface
+        startup_timings['window'] = (time.perf_counter() - start) * 1000
+        # Load the model and the loader frames in the background so the window appears immediately
+        threading.Thread(target=self.load_model_in_background, daemon=True).start()
+        threading.Thread(target=self.load_animation_frames, daemon=True).start()
+        self.after_idle(self.record_first_paint)
+        self.check_model_loaded()
+        self.poll_results()
+        self.toggle_stats()
 
     # Method for loading the pre-trained model
     def load_model(self):
+        start = time.perf_counter()
+        load_tensorflow()
+        startup_timings['tensorflow'] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        # Load the configured pre-trained model tier (or its TFLite conversion, or a cascade of tiers)
+        model = build_backend()
+        # Compile and warm up the single-image path so the first click is fast
+        if isinstance(model, (TFLiteModel, CascadeModel)):
+            self.predict_fn = model
+        else:
+            self.predict_fn = make_predict_fn(model, jit_compile=self.use_xla)
+        warm_up(self.predict_fn)
+        startup_timings['model'] = (time.perf_counter() - start) * 1000
+        return model
+
+    def load_model_in_background(self):
         try:
-            # Load a pre-trained EfficientNetB0 model from TensorFlow
-            return EfficientNetB0(weights='imagenet')
+            self.model_queue.put(self.load_model())
         except Exception as e:
-            messagebox.showerror('Model Error', f'Error loading AI model: {e}')
+            self.model_queue.put(e)
+
+    # Poll from the Tk main loop until the background load has finished
+    def check_model_loaded(self, tick=0):
+        try:
+            result = self.model_queue.get_nowait()
+        except queue.Empty:
+            self.status_label.config(text="Loading AI model" + "." * (tick % 4))
+            self.after(250, self.check_model_loaded, tick + 1)
+            return
+        if isinstance(result, Exception):
+            messagebox.showerror('Model Error', f'Error loading AI model: {result}')
             self.quit()
+            return
+        self.model = result
+        self.status_label.config(text=f"Model ready: {active_model}")
+        mark_startup('model_ready')
+        print(startup_report())
+        if self.exit_after_startup:
+            self.after(0, self.quit)
+            return
+        # Classification becomes available now that the model is loaded
+        if self.image_path:
+            self.classify_btn.state(['!disabled'])
+            self.similar_btn.state(['!disabled'])
+        self.folder_btn.state(['!disabled'])
 
     def init_gui(self):
         # Add a title label at the top
         self.title_label = tk.Label(self, text="AI Image Classifier", font=("Helvetica", 24, "bold"), bg="#f0f0f0")
         self.title_label.pack(pady=10)
 
+        # Status line showing whether the model is still loading
+        self.status_label = tk.Label(self, text="Loading AI model", font=("Helvetica", 12), fg="#555555", bg="#f0f0f0")
+        self.status_label.pack()
+
+        # Inference job queue depth and wait time
+        self.queue_label = tk.Label(self, text="Queue: 0 job(s)", font=("Helvetica", 10), fg="#555555", bg="#f0f0f0")
+        self.queue_label.pack()
+
         # Create main frame
         self.main_frame = tk.Frame(self, bg="#f0f0f0")
         self.main_frame.pack(fill=tk.BOTH, expand=True)
@@ -87,6 +2445,41 @@ class ImageClassifier(tk.Tk):
         self.classify_btn.pack(side=tk.LEFT, padx=10)
         self.classify_btn.state(['disabled'])  # Disable the button initially
 
+        # Button to classify every image in a folder
+        self.folder_btn = ttk.Button(self.button_frame, text="Classify Folder", command=self.classify_folder, style='TButton')
+        self.folder_btn.pack(side=tk.LEFT, padx=10)
+        self.folder_btn.state(['disabled'])  # Enabled once the model has loaded
+
+        # Button to find indexed images similar to the uploaded one
+        self.similar_btn = ttk.Button(self.button_frame, text="Find Similar", command=self.find_similar, style='TButton')
+        self.similar_btn.pack(side=tk.LEFT, padx=10)
+        self.similar_btn.state(['disabled'])  # Enabled with the classify button
+
+        # Button to browse a folder's thumbnails with their stored labels
+        self.gallery_btn = ttk.Button(self.button_frame, text="Gallery", command=self.open_gallery, style='TButton')
+        self.gallery_btn.pack(side=tk.LEFT, padx=10)
+
+        # Toggle for the per-stage latency panel
+        self.stats_var = tk.BooleanVar(value=self.show_stats)
+        self.stats_check = ttk.Checkbutton(self.button_frame, text="Show Stats", variable=self.stats_var, command=self.toggle_stats)
+        self.stats_check.pack(side=tk.LEFT, padx=10)
+
+        # Search box over the results store: label and minimum confidence in percent
+        self.search_frame = tk.Frame(self, bg="#f0f0f0")
+        self.search_frame.pack(pady=(0, 10))
+        tk.Label(self.search_frame, text="Label:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(self.search_frame, textvariable=self.search_var, width=24)
+        self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind('<Return>', lambda event: self.search_results())
+        tk.Label(self.search_frame, text="Min %:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.min_confidence_var = tk.StringVar(value="0")
+        ttk.Entry(self.search_frame, textvariable=self.min_confidence_var, width=5).pack(side=tk.LEFT, padx=5)
+        self.search_btn = ttk.Button(self.search_frame, text="Search", command=self.search_results, style='TButton')
+        self.search_btn.pack(side=tk.LEFT, padx=5)
+        if self.results_store is None:
+            self.search_btn.state(['disabled'])
+
         # Label to display the uploaded image
         self.image_label = tk.Label(self.image_frame, bg="#f0f0f0")
         self.image_label.pack()
@@ -95,37 +2488,48 @@ class ImageClassifier(tk.Tk):
         self.result_label = tk.Label(self.result_frame, text="Classification Result:", font=("Helvetica", 16), bg="#f0f0f0", justify=tk.LEFT)
         self.result_label.pack(anchor='n')
 
-        # Load animation frames
-        self.load_animation_frames()
-
+    # Runs on a background thread: only PIL and numpy work here, PhotoImages are made on the Tk thread
     def load_animation_frames(self):
+        start = time.perf_counter()
         try:
-            # Load an animated GIF
+            # Load the pre-rendered frames of the animated GIF
             loader_gif_path = os.path.join(os.path.dirname(__file__), 'loader.gif')
-            print(f"Attempting to load loader.gif from: {loader_gif_path}")
-            loader_gif = Image.open(loader_gif_path)
-            self.loading_images = []
-            for frame_number, frame in enumerate(ImageSequence.Iterator(loader_gif)):
-                img = frame.copy()
-                img = img.resize((50, 50), Image.LANCZOS)
-                self.loading_images.append(ImageTk.PhotoImage(img.convert('RGBA')))
-            print(f"Loaded {len(self.loading_images)} frames from loader.gif")
+            frames, cached = load_loader_frames(loader_gif_path, asset_dir)
+            print(f"Loaded {len(frames)} frames from loader.gif" + (" (cached)" if cached else ""))
+            self.loading_images = [None] * len(frames)
+            self.loader_frames = frames
         except Exception as e:
-            messagebox.showerror('Animation Error', f'An error occurred while loading animation frames:\n{e}')
             print(f"Error loading animation frames: {e}")
-            self.loading_images = []
+            self.loader_frames = np.zeros((0,) + LOADER_FRAME_SIZE + (4,), dtype=np.uint8)
+        startup_timings['assets'] = (time.perf_counter() - start) * 1000
+
+    # PhotoImage for one loader frame, created on first use
+    def loader_image(self, frame):
+        if self.loading_images[frame] is None:
+            self.loading_images[frame] = ImageTk.PhotoImage(Image.fromarray(self.loader_frames[frame], 'RGBA'))
+        return self.loading_images[frame]
+
+    def record_first_paint(self):
+        self.update_idletasks()
+        mark_startup('first_paint')
 
     # Method to animate the loader
     def animate_loader(self, frame=0):
-        if not self.loading_images:
+        if self.loader_frames is None:
+            # Frames are still loading; try again shortly
+            if self.classification_running:
+                self.after(100, self.animate_loader, frame)
+            return
+        if not len(self.loader_frames):
             print("No loading images available to animate.")
             return  # Exit the function if there are no loading images
         if self.animation_label is None:
             self.animation_label = tk.Label(self.result_frame, bg="#f0f0f0")
             self.animation_label.pack(pady=10)
-        frame %= len(self.loading_images)
-        self.animation_label.configure(image=self.loading_images[frame])
-        self.animation_label.image = self.loading_images[frame]  # Keep a reference
+        frame %= len(self.loader_frames)
+        image = self.loader_image(frame)
+        self.animation_label.configure(image=image)
+        self.animation_label.image = image  # Keep a reference
         # Check if classification is still running
         if not self.classification_running:
             # Remove the loader animation
@@ -138,133 +2542,472 @@ class ImageClassifier(tk.Tk):
     def upload_image(self):
         self.image_path = filedialog.askopenfilename()
         if self.image_path:
-            img = Image.open(self.image_path)
-            img = ImageOps.contain(img, (350, 350))  # Resize image to fit
+            img = open_image(self.image_path, PREVIEW_SIZE)  # Reduced-size decode, EXIF-rotated
+            img = ImageOps.contain(img, PREVIEW_SIZE)  # Resize image to fit
             img = ImageTk.PhotoImage(img)
             self.image_label.configure(image=img)
             self.image_label.image = img
             self.result_label.config(text="Classification Result:")
-            if self.animation_label:
-                self.animation_label.destroy()
-                self.animation_label = None
-            # Enable the classify button after image upload
-            self.classify_btn.state(['!disabled'])
+            # Any queued classification of the previous image is now stale
+            self.worker.cancel('image')
+            self.image_job = None
+            self.click_time = None
+            # Enable the classify button after image upload (once the model is ready)
+            if self.model is not None:
+                self.classify_btn.state(['!disabled'])
+                self.similar_btn.state(['!disabled'])
 
     # Decorators used to ensure file existence and supported image formats
     @file_exists
     @supported_format
     def classify_image(self):
+        # A new click makes any still-queued single-image job stale
+        self.worker.cancel('image')
+        try:
+            run = self.run_clip_classification if is_clip(self.image_path) else self.run_classification
+            self.image_job = self.worker.submit('image', run, self.image_path)
+        except queue.Full:
+            messagebox.showwarning('Busy', 'The classifier is busy, please try again in a moment.')
+            return
+        self.click_time = time.perf_counter()
         # Disable the classify button to prevent multiple clicks
         self.classify_btn.state(['disabled'])
-        # Set classification running flag
-        self.classification_running = True
         # Start the loader animation
-        self.animate_loader()
-        self.update_idletasks()
+        self.start_loader()
+
+    # Runs on the inference worker thread; returns the formatted result
+    def run_classification(self, image_path):
+        # Classification process
+        timings = {}
+        keys = {}
+        predictions = self.predict_image(image_path, timings, keys)
+
+        with timed(timings, 'decode_predictions'):
+            decoded_predictions = decode_predictions(predictions, top=3)[0]
+        latency_stats.record_all(timings)
+        self.store_results([(image_path, decoded_predictions)], keys)
 
-        # Start the classification in a new thread
-        threading.Thread(target=self.run_classification).start()
+        # Format the results with labels and confidence scores
+        results_text = "Classification Result:\n"
+        for i, (imagenet_id, label, confidence) in enumerate(decoded_predictions):
+            results_text += f"{i+1}. {label.replace('_', ' ').title()} ({confidence*100:.2f}%)\n"
+        return results_text
+
+    # Runs on the inference worker thread; classifies sampled frames of an animated GIF
+    def run_clip_classification(self, image_path):
+        decoded_predictions, sampled, frames = classify_clip(self.model, image_path, self.batch_size, self.top_k)
+        self.store_results([(image_path, decoded_predictions)])
+        results_text = f"Clip Result ({sampled} of {frames} frames sampled):\n"
+        for i, line in enumerate(format_predictions(decoded_predictions)):
+            results_text += f"{i+1}. {line}\n"
+        return results_text
+
+    # Prediction vector for one image, served from the cache when its contents were seen before.
+    # The file hash is also written to content_hashes, if given, for the results store.
+    def predict_image(self, image_path, timings=None, content_hashes=None):
+        key = None
+        if self.cache is not None:
+            content_hash = file_sha256(image_path)
+            key = cache_key(content_hash, model_identity)
+            if content_hashes is not None:
+                content_hashes[image_path] = content_hash
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached[np.newaxis]
+        img_array = preprocess_image(image_path, timings)
+        with timed(timings, 'predict'):
+            predictions = np.asarray(self.predict_fn(img_array))
+        if key is not None:
+            self.cache.put(key, predictions[0])
+        return predictions
+
+    def open_gallery(self):
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        paths = list_image_files(folder)
+        if not paths:
+            messagebox.showinfo('Gallery', f'No PNG/JPG/JPEG files found in {folder}')
+            return
+        labels = self.results_store.top1(paths) if self.results_store is not None else {}
+        if self.thumbnails is None:
+            self.thumbnails = ThumbnailCache(thumbnail_dir)  # Shared by every gallery window
+        Gallery(self, paths, labels, self.thumbnails)
 
-    def run_classification(self):
+    # Look up stored results whose top-1 label matches the search box; indexed, so it runs on the Tk thread
+    def search_results(self):
+        label = self.search_var.get()
+        if not label.strip() or self.results_store is None:
+            return
         try:
-            # Classification process
-            img = Image.open(self.image_path).convert('RGB')  # Convert to RGB
-            img_resized = img.resize((224, 224))
-            img_array = np.array(img_resized)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = preprocess_input(img_array)  # Use EfficientNet's preprocessing
+            min_confidence = float(self.min_confidence_var.get() or 0) / 100
+        except ValueError:
+            messagebox.showerror("Error", "Minimum confidence must be a number")
+            return
+        start = time.perf_counter()
+        rows = self.results_store.query(label, min_confidence, limit=20)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        lines = [f"{os.path.basename(path)} ({confidence*100:.2f}%)" for path, confidence, _ in rows]
+        header = f"{len(rows)} image(s) with top-1 '{normalize_label(label)}' above {min_confidence*100:.1f}% ({elapsed_ms:.1f} ms):"
+        self.result_label.config(text="\n".join([header] + lines))
 
-            print("Starting model prediction...")  # Debugging statement
-            predictions = self.model.predict(img_array)
-            print("Model prediction completed.")  # Debugging statement
+    # Start the loader animation unless it is already running
+    def start_loader(self):
+        self.classification_running = True
+        if self.animation_label is None:
+            self.animate_loader()
+        self.update_idletasks()
 
-            decoded_predictions = decode_predictions(predictions, top=3)[0]
-            print("Decoded predictions obtained.")  # Debugging statement
+    # Poll the inference worker's results from the Tk main loop
+    def poll_results(self):
+        self.feed_folder_batches()
+        while True:
+            try:
+                job, result = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job.kind == 'image':
+                # Ignore results for an image that has since been replaced
+                if job is self.image_job:
+                    self.image_job = None
+                    self.process_classification_result(result)
+            elif job.kind == 'similar':
+                self.process_similar_result(result)
+            elif job.kind == 'dedup':
+                self.process_dedup_result(job, result)
+            else:
+                self.process_folder_batch(job, result)
+        self.classification_running = self.worker.busy()
+        self.queue_label.config(text=f"Queue: {self.worker.depth()} job(s) | Last wait: {self.worker.last_wait * 1000:.0f} ms")
+        self.after(POLL_INTERVAL_MS, self.poll_results)
 
-            # Format the results with labels and confidence scores
-            results_text = "Classification Result:\n"
-            for i, (imagenet_id, label, confidence) in enumerate(decoded_predictions):
-                results_text += f"{i+1}. {label.replace('_', ' ').title()} ({confidence*100:.2f}%)\n"
+    # Show or hide the per-stage latency panel
+    def toggle_stats(self):
+        if not self.stats_var.get():
+            if self.stats_label is not None:
+                self.stats_label.destroy()
+                self.stats_label = None
+            return
+        if self.stats_label is None:
+            self.stats_label = tk.Label(self.result_frame, font=("Courier", 10), bg="#f0f0f0", justify=tk.LEFT)
+            self.stats_label.pack(side=tk.BOTTOM, anchor='w')
+            self.refresh_stats()
 
-            # Put the result in the queue
-            self.result_queue.put(results_text)
-        except Exception as e:
-            # Put the exception in the queue
-            self.result_queue.put(e)
-        finally:
-            # Set classification running flag to False
-            self.classification_running = False
-            # Schedule GUI update
-            self.after(0, self.process_classification_result)
-
-    def process_classification_result(self):
-        # Retrieve the result from the queue
-        result = self.result_queue.get()
-        # Hide animation
-        if self.animation_label:
-            self.animation_label.destroy()
-            self.animation_label = None
+    def refresh_stats(self):
+        if self.stats_label is None:
+            return
+        self.stats_label.config(text=latency_stats.report_text())
+        self.after(STATS_REFRESH_MS, self.refresh_stats)
+
+    def process_classification_result(self, result):
         # Re-enable the classify button
         self.classify_btn.state(['!disabled'])
         if isinstance(result, Exception):
             messagebox.showerror('Classification Error', f'An error occurred during classification:\n{result}')
             print(f"Classification error: {result}")  # Debugging statement
+        else:
+            if self.click_time is not None:
+                # Show click-to-result latency for single-image classification
+                result += f"\nLatency: {(time.perf_counter() - self.click_time) * 1000:.0f} ms"
+            if self.cache is not None:
+                result += f"\n{self.cache.stats_text()}"
+            if isinstance(self.model, CascadeModel):
+                result += f"\n{self.model.stats_text()}"
+            timings = {}
+            with timed(timings, 'gui_update'):
+                self.result_label.config(text=result, justify=tk.LEFT, font=("Helvetica", 14))
+                self.update_idletasks()
+            latency_stats.record_all(timings)
+        self.click_time = None
+
+    # Method to look up indexed images similar to the uploaded one
+    @file_exists
+    @supported_format
+    def find_similar(self):
+        try:
+            self.worker.submit('similar', self.run_similarity_query, self.image_path)
+        except queue.Full:
+            messagebox.showwarning('Busy', 'The classifier is busy, please try again in a moment.')
+            return
+        self.similar_btn.state(['disabled'])
+        self.start_loader()
+
+    # Runs on the inference worker thread
+    def run_similarity_query(self, image_path, top=5):
+        if self.embedding_model is None:
+            if active_model == MODEL_NAME and hasattr(self.model, 'get_layer'):
+                # The loaded model is keras EfficientNetB0 itself
+                self.embedding_model, self.embedding_identity = build_embedding_model(self.model), model_identity
+            else:
+                self.embedding_model, self.embedding_identity = build_embedding_extractor()
+        index = EmbeddingIndex(index_dir, self.embedding_identity)
+        if len(index) == 0:
+            return "The similarity index is empty.\nBuild it with: python QOne1.py --index FOLDER"
+        embedding = self.embedding_model(preprocess_image(image_path), training=False)
+        # One extra candidate in case the uploaded image itself is indexed
+        matches = [(path, similarity) for path, similarity in index.query(np.asarray(embedding)[0], top + 1)
+                   if os.path.abspath(path) != os.path.abspath(image_path)][:top]
+        results_text = "Most Similar Images:\n"
+        for i, (path, similarity) in enumerate(matches):
+            results_text += f"{i+1}. {os.path.basename(path)} ({similarity:.3f})\n"
+        return results_text
+
+    def process_similar_result(self, result):
+        self.similar_btn.state(['!disabled'])
+        if isinstance(result, Exception):
+            messagebox.showerror('Similarity Error', f'An error occurred while searching for similar images:\n{result}')
         else:
             self.result_label.config(text=result, justify=tk.LEFT, font=("Helvetica", 14))
 
+    # Method to classify every supported image in a chosen folder
+    def classify_folder(self):
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        paths = list_image_files(folder)
+        if not paths:
+            messagebox.showerror('Error', 'No PNG/JPG/JPEG files found in this folder!')
+            return
+        self.folder_btn.state(['disabled'])
+        self.folder_pending = []  # Files not yet submitted to the worker
+        self.folder_duplicates = {}  # Representative -> near-duplicates reusing its prediction
+        self.folder_total = len(paths)
+        self.folder_done = 0
+        self.folder_recent = []  # Last few results shown in the result panel
+        self.start_loader()
+        if dedup_distance is None:
+            self.folder_pending = paths
+            self.feed_folder_batches()
+            return
+        # Hash the folder on the worker thread so the window stays responsive
+        self.worker.submit('dedup', group_near_duplicates, paths, dedup_distance, self.pipeline, priority=PRIORITY_BULK)
+
+    def process_dedup_result(self, job, result):
+        if isinstance(result, Exception):
+            # Without the pre-pass every file is classified
+            print(f"Near-duplicate pre-pass failed: {result}")
+            result = (job.args[0], {})
+        self.folder_pending, self.folder_duplicates = result
+        self.feed_folder_batches()
+
+    # Keep a few folder batches queued ahead of the worker; single-image clicks can still
+    # jump ahead of them and memory stays bounded however large the folder is
+    def feed_folder_batches(self):
+        while self.folder_pending and self.worker.count('folder') < FOLDER_BATCHES_AHEAD:
+            if self.worker.jobs.full():
+                return
+            # Decoding starts now, while earlier batches are still being classified
+            prepared = self.pipeline.submit(self.folder_pending[:self.batch_size])
+            self.worker.submit('folder', self.run_folder_batch, prepared, priority=PRIORITY_BULK)
+            del self.folder_pending[:self.batch_size]
+
+    # Runs on the inference worker thread
+    def run_folder_batch(self, prepared):
+        keys = {}
+        results = classify_prepared(self.model, prepared, self.top_k, self.cache, content_hashes=keys)
+        self.store_results(with_duplicates(results, self.folder_duplicates), keys)
+        return results
+
+    # Save results to the results store; called on the inference worker thread
+    def store_results(self, results, content_hashes=None):
+        if self.results_store is not None:
+            try:
+                self.results_store.add_many(results, content_hashes=content_hashes)
+            except sqlite3.Error as e:
+                print(f"Could not save results: {e}")
+
+    def process_folder_batch(self, job, results):
+        if isinstance(results, Exception):
+            results = [(path, results) for path, _ in job.args[0]]
+        for path, result in results:
+            duplicates = self.folder_duplicates.get(path, [])
+            self.folder_done += 1 + len(duplicates)
+            if isinstance(result, Exception):
+                line = f"{os.path.basename(path)}: error ({result})"
+            else:
+                line = f"{os.path.basename(path)}: {format_predictions(result)[0]}"
+            if duplicates:
+                line += f" (+{len(duplicates)} near-duplicates)"
+            self.folder_recent = (self.folder_recent + [line])[-10:]
+        # Show progress after every batch
+        progress_text = f"Classified {self.folder_done}/{self.folder_total} images:\n" + "\n".join(self.folder_recent)
+        if self.cache is not None:
+            progress_text += f"\n{self.cache.stats_text()}"
+        if dedup_distance is not None:
+            progress_text += f"\n{dedup_report(self.folder_total, self.folder_duplicates)}"
+        timings = {}
+        with timed(timings, 'gui_update'):
+            self.result_label.config(text=progress_text, justify=tk.LEFT, font=("Helvetica", 12))
+            self.update_idletasks()
+        latency_stats.record_all(timings, count=len(results))
+        if self.folder_done >= self.folder_total:
+            self.folder_btn.state(['!disabled'])
+
 class EnhancedClassifier(ImageClassifier):
+    top_k = 5
+
     def __init__(self):
         super().__init__()
         self.title("Enhanced AI Image Classifier App")  # Method overriding: Change window title
         self.geometry("800x700")  # Method overriding: Change window size
 
-    # Polymorphism: Changing the behavior of classify_image to provide more output
-    @file_exists
-    @supported_format
-    def classify_image(self):
-        # Disable the classify button to prevent multiple clicks
-        self.classify_btn.state(['disabled'])
-        # Set classification running flag
-        self.classification_running = True
-        # Start the loader animation
-        self.animate_loader()
-        self.update_idletasks()
+    # Polymorphism: Changing the behavior of run_classification to provide more output
+    def run_classification(self, image_path):
+        # Classification process
+        timings = {}
+        keys = {}
+        predictions = self.predict_image(image_path, timings, keys)
 
-        # Start the classification in a new thread
-        threading.Thread(target=self.run_classification).start()
+        with timed(timings, 'decode_predictions'):
+            decoded_predictions = decode_predictions(predictions, top=5)[0]
+        latency_stats.record_all(timings)
+        self.store_results([(image_path, decoded_predictions)], keys)
 
-    def run_classification(self):
-        try:
-            # Classification process
-            img = Image.open(self.image_path).convert('RGB')  # Convert to RGB
-            img_resized = img.resize((224, 224))
-            img_array = np.array(img_resized)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = preprocess_input(img_array)
+        # Format the results with labels and confidence scores
+        results_text = "Top 5 Classification Results:\n"
+        for i, (imagenet_id, label, confidence) in enumerate(decoded_predictions):
+            results_text += f"{i+1}. {label.replace('_', ' ').title()} ({confidence*100:.2f}%)\n"
+        return results_text
 
-            print("Starting model prediction...")  # Debugging statement
-            predictions = self.model.predict(img_array)
-            print("Model prediction completed.")  # Debugging statement
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI Image Classifier")
+    parser.add_argument('--folder', help="classify every image in this folder without opening the GUI")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="images per predict call in folder mode")
+    parser.add_argument('--top', type=int, default=5, help="number of predictions reported per image in folder mode")
+    parser.add_argument('--model-store', default=DEFAULT_MODEL_STORE, help="directory of the local serialized model store")
+    parser.add_argument('--no-model-store', action='store_true', help="always build the model from keras.applications")
+    parser.add_argument('--measure-cold-start', action='store_true', help="report model start-up time with and without the model store")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="directory of the on-disk prediction cache")
+    parser.add_argument('--cache-size-mb', type=float, default=CACHE_MAX_DISK_MB, help="size limit of the on-disk prediction cache")
+    parser.add_argument('--no-cache', action='store_true', help="disable the prediction cache")
+    parser.add_argument('--tier', choices=MODEL_TIERS, default=MODEL_NAME, help="model tier")
+    parser.add_argument('--latency-budget', type=float, metavar='MS', help="use the most accurate tier whose per-image latency on this host fits")
+    parser.add_argument('--cascade', type=float, metavar='THRESHOLD',
+                        help="run the fastest tier first and escalate to the selected tier when its top-1 confidence (0-1) is below THRESHOLD")
+    parser.add_argument('--benchmark-tiers', action='store_true', help="measure every tier on this host, save the results and exit")
+    parser.add_argument('--backend', choices=BACKENDS, default='keras', help="inference backend")
+    parser.add_argument('--tflite-threads', type=int, help="number of threads used by the TFLite interpreter")
+    parser.add_argument('--calibration-dir', help="folder of photos used to calibrate int8 quantization")
+    parser.add_argument('--convert-tflite', action='store_true', help="convert the model for the TFLite backends and exit")
+    parser.add_argument('--compare-backends', metavar='FOLDER', help="compare latency and accuracy of all backends on a folder of images")
+    parser.add_argument('--decode-workers', type=int, default=DEFAULT_DECODE_WORKERS, help="parallel image decoders for folder classification (0 decodes inline)")
+    parser.add_argument('--decode-processes', action='store_true', help="decode images in worker processes instead of threads")
+    parser.add_argument('--benchmark-decode', nargs='?', const='', metavar='FOLDER',
+                        help="compare full and draft-mode decode time and peak memory by image size")
+    parser.add_argument('--stats', action='store_true', help="show the per-stage latency panel in the GUI")
+    parser.add_argument('--stats-jsonl', metavar='PATH', help="append per-stage timings as JSON lines in folder mode ('-' for stderr)")
+    parser.add_argument('--serve', action='store_true', help="run the local HTTP inference service")
+    parser.add_argument('--host', default=SERVER_HOST, help="address the inference service listens on")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="port of the inference service")
+    parser.add_argument('--max-batch-size', type=int, default=SERVER_MAX_BATCH_SIZE, help="largest micro-batch of the inference service")
+    parser.add_argument('--max-wait-ms', type=float, default=SERVER_MAX_WAIT_MS, help="longest wait for a micro-batch to fill")
+    parser.add_argument('--index', metavar='FOLDER', help="add new and changed images in a folder to the similarity index")
+    parser.add_argument('--similar', metavar='IMAGE', help="list the indexed images most similar to an image")
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR, help="directory of the similarity index")
+    parser.add_argument('--results-db', default=DEFAULT_RESULTS_DB, help="SQLite database that classification results are saved to")
+    parser.add_argument('--no-results-db', action='store_true', help="do not save classification results")
+    parser.add_argument('--query', metavar='LABEL', help="list stored images whose top-1 label is LABEL and exit")
+    parser.add_argument('--min-confidence', type=float, default=0.0, help="with --query, only matches above this confidence (0-1)")
+    parser.add_argument('--limit', type=int, default=100, help="with --query, maximum number of matches")
+    parser.add_argument('--any-rank', action='store_true', help="with --query, match LABEL anywhere in the stored top-k")
+    parser.add_argument('--asset-dir', default=DEFAULT_ASSET_DIR, help="directory of pre-rendered UI assets")
+    parser.add_argument('--no-asset-cache', action='store_true', help="render the loader animation frames on every launch")
+    parser.add_argument('--measure-startup', action='store_true', help="open the GUI, print the startup-time breakdown and exit")
+    parser.add_argument('--thumbnail-dir', default=DEFAULT_THUMBNAIL_DIR, help="directory of the on-disk gallery thumbnail cache")
+    parser.add_argument('--clip', nargs='+', metavar='PATH', help="classify animated GIFs or folders of numbered frames as clips")
+    parser.add_argument('--every', type=int, default=CLIP_SAMPLE_EVERY, help="with --clip, classify every Nth frame")
+    parser.add_argument('--scene-change', nargs='?', type=float, const=DEFAULT_SCENE_THRESHOLD, metavar='THRESHOLD',
+                        help="with --clip, sample frames on scene changes instead of every Nth frame")
+    parser.add_argument('--shards', type=int, metavar='WORKERS', help="with --folder, classify in this many worker processes")
+    parser.add_argument('--intra-op-threads', type=int, help="TensorFlow intra-op threads per worker process (default: CPUs / workers)")
+    parser.add_argument('--inter-op-threads', type=int, help="TensorFlow inter-op threads per worker process (default: 1)")
+    parser.add_argument('--benchmark-sharding', nargs='?', const='', metavar='FOLDER',
+                        help="report images/second of sharded classification for 1..N worker processes")
+    parser.add_argument('--max-workers', type=int, help="with --benchmark-sharding, most worker processes tried (default: CPU count)")
+    parser.add_argument('--watch', metavar='FOLDER', help="classify images as they arrive in FOLDER, resuming from the manifest")
+    parser.add_argument('--watch-interval', type=float, default=WATCH_INTERVAL, help="seconds between polls in watch mode")
+    parser.add_argument('--once', action='store_true', help="with --watch, classify what is new and exit")
+    parser.add_argument('--manifest', help="manifest file of watch mode (default: one per folder under %s)" % DEFAULT_MANIFEST_DIR)
+    parser.add_argument('--dedup', nargs='?', type=int, const=DEFAULT_DEDUP_DISTANCE, metavar='DISTANCE',
+                        help="reuse predictions for near-duplicate images within this perceptual-hash distance")
+    parser.add_argument('--xla', action='store_true', help="XLA-compile the single-image inference path")
+    parser.add_argument('--measure-latency', nargs='?', const='', metavar='IMAGE',
+                        help="report click-to-result latency of each inference path (synthetic image if none given)")
+    args = parser.parse_args(argv)
+    if args.query and args.no_results_db:
+        parser.error("--query reads the results store and cannot be combined with --no-results-db")
+    if args.shards and args.stats_jsonl:
+        parser.error("--stats-jsonl is not supported with --shards: stage timings are recorded in the worker processes")
 
-            decoded_predictions = decode_predictions(predictions, top=5)[0]
-            print("Decoded predictions obtained.")  # Debugging statement
+    global model_store_dir, cache_dir, cache_max_disk_mb, inference_backend, tflite_threads, calibration_dir
+    global decode_workers, decode_processes, index_dir, dedup_distance, manifest_path, results_db, thumbnail_dir
+    global clip_every, scene_threshold, model_tier, latency_budget_ms, cascade_threshold, asset_dir
+    model_store_dir = None if args.no_model_store else args.model_store
+    cache_dir = None if args.no_cache else args.cache_dir
+    cache_max_disk_mb = args.cache_size_mb
+    inference_backend = args.backend
+    tflite_threads = args.tflite_threads
+    calibration_dir = args.calibration_dir
+    decode_workers = max(0, args.decode_workers)
+    decode_processes = args.decode_processes
+    index_dir = args.index_dir
+    dedup_distance = args.dedup
+    manifest_path = args.manifest
+    results_db = None if args.no_results_db else args.results_db
+    thumbnail_dir = args.thumbnail_dir
+    asset_dir = None if args.no_asset_cache else args.asset_dir
+    clip_every = args.every
+    model_tier = args.tier
+    latency_budget_ms = args.latency_budget
+    cascade_threshold = args.cascade
+    scene_threshold = args.scene_change
 
-            # Format the results with labels and confidence scores
-            results_text = "Top 5 Classification Results:\n"
-            for i, (imagenet_id, label, confidence) in enumerate(decoded_predictions):
-                results_text += f"{i+1}. {label.replace('_', ' ').title()} ({confidence*100:.2f}%)\n"
+    if args.convert_tflite:
+        model = build_model()
+        for backend in BACKENDS[1:]:
+            load_tflite(model, backend)
+            print(f"{backend}: {tflite_path(backend)}")
+        return 0
+    if args.compare_backends:
+        return compare_backends(args.compare_backends, args.top)
 
-            # Put the result in the queue
-            self.result_queue.put(results_text)
-        except Exception as e:
-            # Put the exception in the queue
-            self.result_queue.put(e)
-        finally:
-            # Set classification running flag to False
-            self.classification_running = False
-            # Schedule GUI update
-            self.after(0, self.process_classification_result)
+    if args.benchmark_decode is not None:
+        return benchmark_decode(args.benchmark_decode or None)
+    if args.measure_cold_start:
+        return measure_cold_start(args.model_store)
+    if args.measure_latency is not None:
+        return measure_latency(args.measure_latency or None, top=args.top)
+    if args.index:
+        return index_folder(args.index, args.batch_size)
+    if args.similar:
+        return find_similar(args.similar, args.top)
+    if args.serve:
+        return serve(args.host, args.port, args.max_batch_size, args.max_wait_ms)
+    if args.query:
+        return query_results(args.query, args.min_confidence, args.limit, args.any_rank)
+    if args.benchmark_tiers:
+        return report_tiers()
+    if args.benchmark_sharding is not None:
+        return benchmark_sharding(args.benchmark_sharding or None, args.max_workers, args.batch_size)
+    if args.clip:
+        return run_clips(args.clip, args.batch_size, args.top)
+    if args.watch:
+        return run_watch(args.watch, args.batch_size, args.top, args.watch_interval, args.once)
+    if args.folder and args.shards:
+        return run_sharded(args.folder, args.shards, args.intra_op_threads, args.inter_op_threads, args.batch_size, args.top)
+    if args.folder:
+        return run_headless_folder(args.folder, args.batch_size, args.top, args.stats_jsonl)
+
+    startup_timings['imports'] = (IMPORTS_DONE - STARTUP_BEGIN) * 1000
+    ImageClassifier.use_xla = args.xla
+    ImageClassifier.exit_after_startup = args.measure_startup
+    ImageClassifier.show_stats = args.stats
 
-if __name__ == "__main__":
     app = EnhancedClassifier()
+    app.batch_size = max(1, args.batch_size)
+    app.top_k = args.top
     app.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,7 @@
 import pygame
 import random
+import argparse
+import time
 
 pygame.init()
 
@@ -12,11 +14,47 @@ BLACK = (0, 0, 0)
 RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
+TRANSPARENT = (255, 0, 255)  # Colour key of the tank textures
+CELL_SIZE = 80  # Size of a spatial-hash cell, about one tank wide
+
+# Stress scenario defaults (python QTwo.py --stress)
+STRESS_BULLETS = 3000
+STRESS_ENEMIES = 3000
+STRESS_FRAMES = 60
+BLIT_BENCHMARK_SPRITES = 500  # Tanks blitted per frame by --blit-benchmark
+BLIT_BENCHMARK_FRAMES = 200
 
 # Load background image and scale it to the screen size
 background_image = pygame.image.load("game2.jpg")
 background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
 
+# Textures rendered once per key and converted to the display format, so blits are plain copies
+# instead of per-pixel format conversions and all sprites of one type (and colour) share one surface.
+# Colour-keyed textures are RLE encoded, which skips their transparent runs when blitting.
+# The display mode must be set before the first get().
+class TextureCache:
+    def __init__(self):
+        self.textures = {}
+
+    def get(self, key, render):
+        texture = self.textures.get(key)
+        if texture is None:
+            texture = render()
+            if texture.get_flags() & pygame.SRCALPHA:
+                texture = texture.convert_alpha()
+            else:
+                colorkey = texture.get_colorkey()
+                texture = texture.convert()
+                if colorkey is not None:
+                    texture.set_colorkey(colorkey, pygame.RLEACCEL)
+            self.textures[key] = texture
+        return texture
+
+    def size_bytes(self):
+        return sum(texture.get_bytesize() * texture.get_width() * texture.get_height() for texture in self.textures.values())
+
+textures = TextureCache()
+
 # Camera class to handle dynamic movement
 class Camera:
     def __init__(self, width, height):
@@ -45,8 +83,7 @@ class Camera:
 class Player(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = pygame.Surface((80, 40), pygame.SRCALPHA)  # Transparent background
-        self.draw_tank(GREEN)  # Draw the tank onto the surface
+        self.draw_tank(GREEN)  # Shared green tank texture
         self.rect = self.image.get_rect()
         self.rect.x = 100
         self.rect.y = SCREEN_HEIGHT - 100
@@ -58,17 +95,24 @@ class Player(pygame.sprite.Sprite):
         self.health = 100
         self.lives = 3
 
-    def draw_tank(self, color):
+    @staticmethod
+    def render_tank(color):
+        image = pygame.Surface((80, 40))
+        image.fill(TRANSPARENT)
+        image.set_colorkey(TRANSPARENT)  # Transparent background
         # Tank body
-        pygame.draw.rect(self.image, color, (10, 20, 60, 20))  # Main body of the tank
+        pygame.draw.rect(image, color, (10, 20, 60, 20))  # Main body of the tank
 
         # Tank turret (a rectangle on top of the body)
-        pygame.draw.rect(self.image, color, (20, 2, 30, 40))  # Tank turret
+        pygame.draw.rect(image, color, (20, 2, 30, 40))  # Tank turret
 
         # Tank tracks (two rectangles under the body)
-        pygame.draw.rect(self.image, BLACK, (10, 35, 60, 5))  # Bottom track
-        pygame.draw.rect(self.image, BLACK, (10, 15, 60, 5))  # Top track
+        pygame.draw.rect(image, BLACK, (10, 35, 60, 5))  # Bottom track
+        pygame.draw.rect(image, BLACK, (10, 15, 60, 5))  # Top track
+        return image
 
+    def draw_tank(self, color):
+        self.image = textures.get(('player tank', color), lambda: self.render_tank(color))
 
 
     def update(self):
@@ -95,17 +139,74 @@ class Player(pygame.sprite.Sprite):
         self.velocity_y = self.jump_power
 
     def shoot(self):
-        bullet = Projectile(self.rect.centerx, self.rect.top)
+        bullet = projectile_pool.acquire(self.rect.centerx, self.rect.top)
         all_sprites.add(bullet)
         bullets.add(bullet)
 
+# Recycles sprites of one class. A pooled sprite goes back to its pool when it is killed, and
+# acquire() hands it out again after reset() instead of building a new one. Sprites killed during
+# a frame only become reusable at end_frame(), so a sprite is never reused while a group update
+# that started before its death is still walking over it.
+class SpritePool:
+    def __init__(self, sprite_class):
+        self.sprite_class = sprite_class
+        self.free = []
+        self.released = []  # Killed this frame
+        self.allocated = 0  # Sprites ever built, i.e. the pool size
+        self.allocation_rate = 0.0  # Sprites built per second over the last second
+        self.window_start = time.perf_counter()
+        self.window_allocated = 0
+
+    def acquire(self, *args, **kwargs):
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args, **kwargs)
+        else:
+            sprite = self.sprite_class(*args, **kwargs)
+            sprite.pool = self
+            self.allocated += 1
+        return sprite
+
+    def release(self, sprite):
+        self.released.append(sprite)
+
+    def end_frame(self):
+        self.free.extend(self.released)
+        self.released.clear()
+        now = time.perf_counter()
+        if now - self.window_start >= 1:
+            self.allocation_rate = (self.allocated - self.window_allocated) / (now - self.window_start)
+            self.window_start = now
+            self.window_allocated = self.allocated
+
+    def in_use(self):
+        return self.allocated - len(self.free) - len(self.released)
+
+# Base class of pooled sprites: kill() hands the sprite back to the pool it came from
+class PooledSprite(pygame.sprite.Sprite):
+    pool = None
+
+    def kill(self):
+        if self.alive():
+            super().kill()
+            if self.pool is not None:
+                self.pool.release(self)
+
 # Projectile (bullet) class
-class Projectile(pygame.sprite.Sprite):
+class Projectile(PooledSprite):
     def __init__(self, x, y, speed=-10):
         super().__init__()
-        self.image = pygame.Surface((10, 5))  # Smaller for bullet
-        self.image.fill(RED)
+        self.image = textures.get('projectile', self.render_image)  # Shared by every projectile
         self.rect = self.image.get_rect()
+        self.reset(x, y, speed)
+
+    @staticmethod
+    def render_image():
+        image = pygame.Surface((10, 5))  # Smaller for bullet
+        image.fill(RED)
+        return image
+
+    def reset(self, x, y, speed=-10):
         self.rect.centerx = x
         self.rect.centery = y
         self.speed = speed
@@ -116,23 +217,33 @@ class Projectile(pygame.sprite.Sprite):
             self.kill()
 
 # Enemy class (tank-like)
-class Enemy(pygame.sprite.Sprite):
+class Enemy(PooledSprite):
     def __init__(self, speed_increase=0):
         super().__init__()
-        self.image = pygame.Surface((80, 40), pygame.SRCALPHA)  # Transparent background
-        self.draw_tank(RED)  # Red tank
+        self.draw_tank(RED)  # Shared red tank texture
         self.rect = self.image.get_rect()
+        self.reset(speed_increase)
+
+    def reset(self, speed_increase=0):
         self.rect.x = random.randint(100, SCREEN_WIDTH - 100)
         self.rect.y = random.randint(-100, -40)  # Start above the screen
         self.speed = random.randint(1, 3) + speed_increase
         self.shoot_delay = random.randint(80, 180)  # Random delay before each shot
 
-    def draw_tank(self, color):
+    @staticmethod
+    def render_tank(color):
+        image = pygame.Surface((80, 40))
+        image.fill(TRANSPARENT)
+        image.set_colorkey(TRANSPARENT)  # Transparent background
         # Tank body
-        pygame.draw.rect(self.image, color, (10, 20, 60, 20))  # Main body of the tank
-        pygame.draw.rect(self.image, color, (20, 30, 10, 20))  # Tank turret
-        pygame.draw.rect(self.image, BLACK, (10, 35, 60, 5))  # Bottom track
-        pygame.draw.rect(self.image, BLACK, (10, 15, 60, 5))  # Top track
+        pygame.draw.rect(image, color, (10, 20, 60, 20))  # Main body of the tank
+        pygame.draw.rect(image, color, (20, 30, 10, 20))  # Tank turret
+        pygame.draw.rect(image, BLACK, (10, 35, 60, 5))  # Bottom track
+        pygame.draw.rect(image, BLACK, (10, 15, 60, 5))  # Top track
+        return image
+
+    def draw_tank(self, color):
+        self.image = textures.get(('enemy tank', color), lambda: self.render_tank(color))
 
     def update(self):
         self.rect.y += self.speed  # Move the enemy downwards
@@ -146,7 +257,7 @@ class Enemy(pygame.sprite.Sprite):
             self.shoot_delay = random.randint(30, 120)  # Reset delay for next shot
 
     def shoot(self):
-        bullet = Projectile(self.rect.centerx, self.rect.bottom, speed=10)  # Enemy bullets go downwards
+        bullet = projectile_pool.acquire(self.rect.centerx, self.rect.bottom, speed=10)  # Enemy bullets go downwards
         all_sprites.add(bullet)
         enemy_bullets.add(bullet)
 
@@ -154,8 +265,7 @@ class Enemy(pygame.sprite.Sprite):
 class Collectible(pygame.sprite.Sprite):
     def __init__(self):
         super().__init__()
-        self.image = pygame.Surface((20, 20))
-        self.image.fill(BLUE)
+        self.image = textures.get('collectible', self.render_image)  # Shared by every collectible
         self.rect = self.image.get_rect()
         
         # Random x position within the screen width
@@ -164,13 +274,168 @@ class Collectible(pygame.sprite.Sprite):
         # Set y position closer to the bottom of the screen
         self.rect.y = random.randint(SCREEN_HEIGHT - 200, SCREEN_HEIGHT - 50)  # Adjust this range as needed
     
+    @staticmethod
+    def render_image():
+        image = pygame.Surface((20, 20))
+        image.fill(BLUE)
+        return image
+
     def update(self):
         pass
 
+# Sprite group with a uniform-grid spatial hash over the world (WORLD_WIDTH x SCREEN_HEIGHT).
+# Each sprite is stored in every cell its rect overlaps, and collision queries only test the
+# sprites in the cells the query rect overlaps, instead of every sprite in the group.
+# Sprites outside the world are kept in the border cells.
+class SpatialGroup(pygame.sprite.Group):
+    def __init__(self, width, height, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.columns = -(-width // cell_size)
+        self.rows = -(-height // cell_size)
+        self.cells = {}  # (column, row) -> set of sprites
+        self.sprite_cells = {}  # sprite -> (first column, first row, last column, last row)
+        super().__init__()
+
+    def cell_range(self, rect):
+        first_column = min(max(rect.left // self.cell_size, 0), self.columns - 1)
+        last_column = min(max((rect.right - 1) // self.cell_size, 0), self.columns - 1)
+        first_row = min(max(rect.top // self.cell_size, 0), self.rows - 1)
+        last_row = min(max((rect.bottom - 1) // self.cell_size, 0), self.rows - 1)
+        return first_column, first_row, last_column, last_row
+
+    def place(self, sprite, cell_range):
+        first_column, first_row, last_column, last_row = cell_range
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                self.cells.setdefault((column, row), set()).add(sprite)
+        self.sprite_cells[sprite] = cell_range
+
+    def unplace(self, sprite):
+        first_column, first_row, last_column, last_row = self.sprite_cells.pop(sprite)
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                cell = self.cells[(column, row)]
+                cell.discard(sprite)
+                if not cell:
+                    del self.cells[(column, row)]
+
+    # Called by pygame whenever a sprite joins or leaves the group (including sprite.kill())
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        if sprite not in self.sprite_cells:
+            self.place(sprite, self.cell_range(sprite.rect))
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        if sprite in self.sprite_cells:
+            self.unplace(sprite)
+
+    # Re-bucket sprites after they moved; only sprites that crossed into other cells are touched
+    def refresh(self):
+        for sprite, cell_range in list(self.sprite_cells.items()):
+            new_range = self.cell_range(sprite.rect)
+            if new_range != cell_range:
+                self.unplace(sprite)
+                self.place(sprite, new_range)
+
+    # Same result as pygame.sprite.spritecollide(sprite, group, dokill), through the grid
+    def collide(self, sprite, dokill=False):
+        rect = sprite.rect
+        first_column, first_row, last_column, last_row = self.cell_range(rect)
+        if first_column == last_column and first_row == last_row:
+            # Common case for bullets: one cell, so no sprite can be seen twice
+            hits = [other for other in self.cells.get((first_column, first_row), ()) if rect.colliderect(other.rect)]
+        else:
+            hits = []
+            seen = set()
+            for column in range(first_column, last_column + 1):
+                for row in range(first_row, last_row + 1):
+                    for other in self.cells.get((column, row), ()):
+                        if other not in seen:
+                            seen.add(other)
+                            if rect.colliderect(other.rect):
+                                hits.append(other)
+        if dokill:
+            for other in hits:
+                other.kill()
+        return hits
+
+
+# Draws a frame and pushes it to the display. In dirty-rect mode only the areas drawn last frame are
+# restored from the background and only those plus this frame's blits are sent with display.update();
+# when the camera scrolls every sprite moves on screen, so the frame is redrawn and flipped in full.
+# The sprite groups' own draw() cannot be used here because sprites are drawn at a camera offset.
+class FrameRenderer:
+    def __init__(self, screen, background, dirty=False):
+        self.screen = screen
+        self.background = background
+        self.dirty = dirty
+        self.screen_rect = screen.get_rect()
+        self.offset = None  # Camera offset of the last frame
+        self.drawn = []  # Screen areas drawn over the background last frame
+        self.blits = []
+        self.full_frame = True
+        self.frames = 0
+        self.full_frames = 0
+        self.total_pixels = 0
+        self.last_pixels = 0
+
+    def begin_frame(self, camera):
+        offset = camera.camera.topleft
+        self.full_frame = not self.dirty or offset != self.offset
+        self.offset = offset
+        if self.full_frame:
+            self.screen.blit(self.background, (0, 0))
+        else:
+            for rect in self.drawn:
+                self.screen.blit(self.background, rect, rect)  # Erase last frame's sprites and text
+        self.blits = []
+
+    def blit(self, image, position):
+        rect = self.screen.blit(image, position)  # Clipped to the screen
+        if rect.width and rect.height:
+            self.blits.append(rect)
+
+    def end_frame(self):
+        if self.full_frame:
+            pygame.display.flip()
+            pixels = self.screen_rect.width * self.screen_rect.height
+            self.full_frames += 1
+        else:
+            rects = self.merge(self.drawn + self.blits)
+            pygame.display.update(rects)
+            pixels = sum(rect.width * rect.height for rect in rects)
+        self.drawn = self.blits
+        self.frames += 1
+        self.total_pixels += pixels
+        self.last_pixels = pixels
+
+    # Replace each cluster of overlapping rects by their bounding box, so no pixel is pushed (or counted)
+    # twice; last frame's erase rect and this frame's blit of a slowly moving sprite mostly overlap
+    @staticmethod
+    def merge(rects):
+        merged = []
+        for rect in rects:
+            rect = rect.copy()
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect.union_ip(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
+
+    def report(self):
+        if not self.frames:
+            return "no frames drawn"
+        return (f"{self.total_pixels / self.frames:,.0f} pixels pushed per frame on average over {self.frames} frames "
+                f"({self.full_frames} full redraws, a full frame is {self.screen_rect.width * self.screen_rect.height:,} pixels)")
+
 
 # Main game loop
 screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 pygame.display.set_caption("Tank Side-Scrolling Game")
+raw_background_image = background_image
+background_image = textures.get('background', lambda: raw_background_image)  # Display format from here on
 clock = pygame.time.Clock()
 
 player = Player()
@@ -178,9 +443,14 @@ camera = Camera(WORLD_WIDTH, SCREEN_HEIGHT)
 
 all_sprites = pygame.sprite.Group()
 bullets = pygame.sprite.Group()
-enemy_bullets = pygame.sprite.Group()  # Group for enemy bullets
-enemies = pygame.sprite.Group()
-collectibles = pygame.sprite.Group()
+# Groups the player or bullets are tested against keep a spatial hash
+enemy_bullets = SpatialGroup(WORLD_WIDTH, SCREEN_HEIGHT)  # Group for enemy bullets
+enemies = SpatialGroup(WORLD_WIDTH, SCREEN_HEIGHT)
+collectibles = SpatialGroup(WORLD_WIDTH, SCREEN_HEIGHT)
+
+# Bullets and enemies are recycled instead of rebuilt
+projectile_pool = SpritePool(Projectile)
+enemy_pool = SpritePool(Enemy)
 
 all_sprites.add(player)
 
@@ -188,28 +458,119 @@ all_sprites.add(player)
 score = 0
 level = 1
 font = pygame.font.SysFont(None, 36)
+small_font = pygame.font.SysFont(None, 24)
 
 def display_info():
     health_text = font.render(f"Health: {player.health}", True, WHITE)
     lives_text = font.render(f"Lives: {player.lives}", True, WHITE)
     score_text = font.render(f"Score: {score}", True, WHITE)
     level_text = font.render(f"Level: {level}", True, WHITE)
-    screen.blit(health_text, (10, 10))
-    screen.blit(lives_text, (10, 40))
-    screen.blit(score_text, (10, 70))
-    screen.blit(level_text, (10, 100))
-
-running = True
+    renderer.blit(health_text, (10, 10))
+    renderer.blit(lives_text, (10, 40))
+    renderer.blit(score_text, (10, 70))
+    renderer.blit(level_text, (10, 100))
+    # Pool sizes and how many sprites had to be built in the last second
+    pool_text = small_font.render(f"Pools: bullets {projectile_pool.in_use()}/{projectile_pool.allocated} "
+                                  f"({projectile_pool.allocation_rate:.0f}/s), enemies {enemy_pool.in_use()}/{enemy_pool.allocated} "
+                                  f"({enemy_pool.allocation_rate:.0f}/s)", True, WHITE)
+    renderer.blit(pool_text, (10, 130))
+    # Display traffic of the previous frame
+    pixels_text = small_font.render(f"Pixels pushed: {renderer.last_pixels:,} "
+                                    f"({'dirty rects' if renderer.dirty else 'full redraw'})", True, WHITE)
+    renderer.blit(pixels_text, (10, 155))
+
+# Stress scenario: thousands of bullets and enemies moving over the world. Times the bullet-enemy
+# collision pass once with a spritecollide call per bullet and once through the spatial hash.
+def run_stress(bullet_count=STRESS_BULLETS, enemy_count=STRESS_ENEMIES, frames=STRESS_FRAMES):
+    random.seed(1)
+    grid_enemies = SpatialGroup(WORLD_WIDTH, SCREEN_HEIGHT)
+    plain_enemies = pygame.sprite.Group()
+    for _ in range(enemy_count):
+        enemy = Enemy()
+        enemy.rect.x = random.randint(0, WORLD_WIDTH - enemy.rect.width)
+        enemy.rect.y = random.randint(0, SCREEN_HEIGHT - enemy.rect.height)
+        grid_enemies.add(enemy)
+        plain_enemies.add(enemy)
+    stress_bullets = [Projectile(random.randint(0, WORLD_WIDTH), random.randint(0, SCREEN_HEIGHT), speed=random.choice((-10, 10)))
+                      for _ in range(bullet_count)]
+    movers = stress_bullets + plain_enemies.sprites()
+
+    timings = {'spritecollide': [], 'spatial hash': []}
+    hits = {'spritecollide': 0, 'spatial hash': 0}
+    for _ in range(frames):
+        # Move everything, wrapping vertically so the numbers stay constant
+        for sprite in movers:
+            sprite.rect.y = (sprite.rect.y + sprite.speed) % SCREEN_HEIGHT
+
+        start = time.perf_counter()
+        for bullet in stress_bullets:
+            hits['spritecollide'] += len(pygame.sprite.spritecollide(bullet, plain_enemies, False))
+        timings['spritecollide'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        grid_enemies.refresh()
+        for bullet in stress_bullets:
+            hits['spatial hash'] += len(grid_enemies.collide(bullet))
+        timings['spatial hash'].append(time.perf_counter() - start)
+
+    print(f"{bullet_count} bullets x {enemy_count} enemies, {frames} frames (collision pass per frame):")
+    for method, samples in timings.items():
+        samples = sorted(samples)
+        mean_ms = sum(samples) / len(samples) * 1000
+        print(f"  {method:<14} mean {mean_ms:8.2f} ms   worst {samples[-1] * 1000:8.2f} ms   hits {hits[method]}")
+    mean = {method: sum(samples) / len(samples) for method, samples in timings.items()}
+    print(f"  speedup {mean['spritecollide'] / mean['spatial hash']:.1f}x (a 60 FPS frame has 16.7 ms)")
+
+# Blit cost of one frame: the background plus many tanks, first with per-instance surfaces in
+# their original format (as before the texture cache), then with the shared converted textures
+def run_blit_benchmark(count=BLIT_BENCHMARK_SPRITES, frames=BLIT_BENCHMARK_FRAMES):
+    random.seed(1)
+    positions = [(random.randint(0, SCREEN_WIDTH - 80), random.randint(0, SCREEN_HEIGHT - 40)) for _ in range(count)]
+    before = []
+    for i in range(count):
+        image = pygame.Surface((80, 40), pygame.SRCALPHA)
+        image.blit(Enemy.render_tank(RED) if i % 2 else Player.render_tank(GREEN), (0, 0))
+        before.append(image)
+    after = [Enemy().image if i % 2 else Player().image for i in range(count)]
+    results = {}
+    for name, background, images in (('before', raw_background_image, before), ('after', background_image, after)):
+        samples = []
+        for _ in range(frames):
+            start = time.perf_counter()
+            screen.blit(background, (0, 0))
+            for image, position in zip(images, positions):
+                screen.blit(image, position)
+            samples.append(time.perf_counter() - start)
+        samples.sort()
+        results[name] = sum(samples) / len(samples) * 1000
+        distinct = {id(image): image for image in images}.values()
+        memory_kb = sum(image.get_bytesize() * image.get_width() * image.get_height() for image in distinct) / 1024
+        print(f"  {name:<7} {results[name]:7.2f} ms per frame (median {samples[len(samples) // 2] * 1000:6.2f} ms), "
+              f"{len(distinct)} tank surface(s), {memory_kb:8.1f} KB")
+    print(f"Background + {count} tanks per frame, display depth {screen.get_bitsize()} bit: "
+          f"{results['before'] / results['after']:.2f}x faster with the texture cache")
+
+parser = argparse.ArgumentParser(description="Tank side-scrolling game")
+parser.add_argument('--stress', action='store_true', help="run the collision stress scenario instead of the game")
+parser.add_argument('--bullets', type=int, default=STRESS_BULLETS, help="bullets in the stress scenario")
+parser.add_argument('--enemies', type=int, default=STRESS_ENEMIES, help="enemies in the stress scenario")
+parser.add_argument('--frames', type=int, default=STRESS_FRAMES, help="frames simulated by the stress scenario")
+parser.add_argument('--blit-benchmark', action='store_true', help="measure blit cost with and without the texture cache")
+parser.add_argument('--dirty-rects', action='store_true', help="only redraw and update the screen areas that changed")
+args = parser.parse_args()
+
+renderer = FrameRenderer(screen, background_image, dirty=args.dirty_rects)
+
+running = not (args.stress or args.blit_benchmark)
 game_over = False
+if args.stress:
+    run_stress(args.bullets, args.enemies, args.frames)
+if args.blit_benchmark:
+    run_blit_benchmark()
 
 # Game Loop
 while running:
     clock.tick(60)
-    screen.fill(BLACK)
-
-    # Draw the background image
-    screen.blit(background_image, (0, 0))
-    
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
@@ -219,7 +580,7 @@ while running:
 
     # Spawn enemies with increasing difficulty per level
     if random.randint(1, 60) == 1:
-        enemy = Enemy(speed_increase=level)  # Enemies get faster with higher levels
+        enemy = enemy_pool.acquire(speed_increase=level)  # Enemies get faster with higher levels
         all_sprites.add(enemy)
         enemies.add(enemy)
 
@@ -231,16 +592,19 @@ while running:
 
     if not game_over:
         all_sprites.update()
+        # Move the sprites to their new cells before testing collisions
+        enemies.refresh()
+        enemy_bullets.refresh()
 
         # Bullet-enemy collision
         for bullet in bullets:
-            enemy_hits = pygame.sprite.spritecollide(bullet, enemies, True)
+            enemy_hits = enemies.collide(bullet, True)
             if enemy_hits:
                 bullet.kill()
                 score += 10
 
         # Bullet-player collision
-        if pygame.sprite.spritecollide(player, enemy_bullets, True):
+        if enemy_bullets.collide(player, True):
             player.health -= 10
             if player.health <= 0:
                 player.lives -= 1
@@ -249,7 +613,7 @@ while running:
                 game_over = True
 
         # Player-enemy collision
-        enemy_hits = pygame.sprite.spritecollide(player, enemies, False)
+        enemy_hits = enemies.collide(player)
         if enemy_hits:
             player.health -= 1
             if player.health <= 0:
@@ -259,7 +623,7 @@ while running:
                 game_over = True
 
         # Player-collectible collision
-        collectible_hits = pygame.sprite.spritecollide(player, collectibles, True)
+        collectible_hits = collectibles.collide(player, True)
         if collectible_hits:
             player.health += 10
             if player.health > 100:
@@ -272,15 +636,16 @@ while running:
     # Update camera to follow the player
     camera.update(player)
 
-    # Render all sprites with camera offset
+    # Draw the background (all of it, or only where last frame drew) and all sprites with camera offset
+    renderer.begin_frame(camera)
     for sprite in all_sprites:
-        screen.blit(sprite.image, camera.apply(sprite))
+        renderer.blit(sprite.image, camera.apply(sprite))
 
     display_info()
 
     if game_over:
         game_over_text = font.render("Game Over! Press R to Restart", True, WHITE)
-        screen.blit(game_over_text, (SCREEN_WIDTH//4, SCREEN_HEIGHT//2))
+        renderer.blit(game_over_text, (SCREEN_WIDTH//4, SCREEN_HEIGHT//2))
         keys = pygame.key.get_pressed()
         if keys[pygame.K_r]:  # Restart on pressing 'R'
             game_over = False
@@ -289,6 +654,10 @@ while running:
             score = 0
             level = 1
 
-    pygame.display.flip()
+    renderer.end_frame()
+    projectile_pool.end_frame()
+    enemy_pool.end_frame()
 
+if renderer.frames:
+    print(renderer.report())
 pygame.quit()
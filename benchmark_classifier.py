@@ -0,0 +1,204 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Benchmark suite for the classifier in QOne1.py. Drives the pipeline headlessly on a synthetic or
+# local image corpus and reports cold start, warm single-image latency, batch throughput, peak RSS
+# and prediction cache behaviour as JSON. Each metric is compared against a stored baseline run
+# and the exit code is 1 if any metric regressed by more than the tolerance.
+#
+# Baselines are per machine, so none is committed. Record one on the machine that runs the check:
+#     python benchmark_classifier.py --save-baseline benchmark_baseline.json
+# Later runs compare against benchmark_baseline.json next to this script when it exists, or
+# against the file given with --baseline.
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(SERVICE_DIR, 'benchmark_baseline.json')
+BATCH_SIZES = [1, 8, 32]
+LATENCY_RUNS = 30  # Timed single-image predictions
+THROUGHPUT_IMAGES = 64  # Images classified per batch size
+SYNTHETIC_IMAGES = 16
+DEFAULT_TOLERANCE = 0.15  # Allowed relative change in the bad direction
+
+# Direction of each metric: True if higher is better
+METRICS = {
+    'cold_start_ms': False,
+    'first_prediction_ms': False,
+    'warm_latency_p50_ms': False,
+    'warm_latency_p95_ms': False,
+    'peak_rss_mb': False,
+    'cache_hit_rate': True,
+    'cache_warm_images_per_s': True,
+}
+
+def throughput_metric(batch_size):
+    return f'throughput_b{batch_size}_images_per_s'
+
+def higher_is_better(metric):
+    return METRICS.get(metric, metric.startswith('throughput_'))
+
+# Peak resident memory of this process in MB, or None where the resource module is missing
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024  # Bytes on macOS, KiB on Linux
+
+# Import QOne1 in a benchmark child process and apply the model settings
+def load_classifier(settings):
+    sys.path.insert(0, SERVICE_DIR)
+    import QOne1
+    QOne1.model_store_dir = settings['model_store']
+    QOne1.inference_backend = settings['backend']
+    QOne1.model_tier = settings['tier']
+    QOne1.cache_dir = None
+    QOne1.results_db = None
+    return QOne1
+
+# Runs in a fresh process: import, model load and first prediction, as a user launching the app sees them
+def measure_cold_start(settings, path):
+    start = time.perf_counter()
+    classifier = load_classifier(settings)
+    classifier.load_tensorflow()
+    model = classifier.build_backend()
+    loaded = time.perf_counter()
+    model.predict(classifier.preprocess_image(path), verbose=0)
+    end = time.perf_counter()
+    return {'cold_start_ms': (loaded - start) * 1000, 'first_prediction_ms': (end - loaded) * 1000}
+
+# Runs in a fresh process, so its peak RSS belongs to the benchmark alone
+def measure_warm(settings, paths, batch_sizes):
+    classifier = load_classifier(settings)
+    model = classifier.build_backend()
+    metrics = {}
+
+    # Single image: the GUI's compiled path (decode, preprocess and predict)
+    predict_fn = model if isinstance(model, (classifier.TFLiteModel, classifier.CascadeModel)) else classifier.make_predict_fn(model)
+    classifier.warm_up(predict_fn)
+    latencies = []
+    for i in range(LATENCY_RUNS):
+        start = time.perf_counter()
+        np.asarray(predict_fn(classifier.preprocess_image(paths[i % len(paths)])))
+        latencies.append((time.perf_counter() - start) * 1000)
+    metrics['warm_latency_p50_ms'] = float(np.percentile(latencies, 50))
+    metrics['warm_latency_p95_ms'] = float(np.percentile(latencies, 95))
+
+    # Folder classification at several batch sizes, without the cache
+    corpus = [paths[i % len(paths)] for i in range(max(THROUGHPUT_IMAGES, len(paths)))]
+    for batch_size in batch_sizes:
+        list(classifier.classify_files(model, corpus[:batch_size], batch_size))  # Trace this batch shape first
+        start = time.perf_counter()
+        for _ in classifier.classify_files(model, corpus, batch_size):
+            pass
+        metrics[throughput_metric(batch_size)] = len(corpus) / (time.perf_counter() - start)
+
+    # Prediction cache: a first pass fills a fresh cache, a second pass over the same files should hit it
+    with tempfile.TemporaryDirectory() as cache_root:
+        cache = classifier.PredictionCache(cache_root)
+        for _ in classifier.classify_files(model, paths, max(batch_sizes), cache=cache):
+            pass
+        hits, misses = cache.hits, cache.misses
+        start = time.perf_counter()
+        for _ in classifier.classify_files(model, paths, max(batch_sizes), cache=cache):
+            pass
+        elapsed = time.perf_counter() - start
+        lookups = (cache.hits - hits) + (cache.misses - misses)
+        metrics['cache_hit_rate'] = (cache.hits - hits) / max(1, lookups)
+        metrics['cache_warm_images_per_s'] = len(paths) / elapsed
+
+    metrics['peak_rss_mb'] = peak_rss_mb()
+    return metrics
+
+def run_suite(settings, paths, batch_sizes):
+    context = multiprocessing.get_context('spawn')
+    metrics = {}
+    for measure, args in ((measure_cold_start, (settings, paths[0])), (measure_warm, (settings, paths, batch_sizes))):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            metrics.update(executor.submit(measure, *args).result())
+    return {k: round(v, 3) if v is not None else None for k, v in metrics.items()}
+
+# Compare against a baseline; returns the names of metrics that regressed beyond the tolerance
+def compare(metrics, baseline, tolerance):
+    regressions = []
+    print(f"{'metric':<34} {'baseline':>10} {'current':>10} {'change':>8}")
+    for metric, value in metrics.items():
+        reference = baseline.get(metric)
+        if value is None or not reference:
+            print(f"{metric:<34} {'n/a':>10} {value if value is not None else 'n/a':>10}")
+            continue
+        change = (value - reference) / reference
+        worse = -change if higher_is_better(metric) else change
+        status = ''
+        if worse > tolerance:
+            status = 'REGRESSION'
+            regressions.append(metric)
+        print(f"{metric:<34} {reference:>10.2f} {value:>10.2f} {change:>+7.1%} {status}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite for the QOne1.py classifier")
+    parser.add_argument('--corpus', help="folder of images to benchmark on (synthetic photos if not given)")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES, help="batch sizes of the throughput runs")
+    parser.add_argument('--model-store', default=None, help="model store passed to the classifier (its default if not given)")
+    parser.add_argument('--backend', default='keras', help="inference backend")
+    parser.add_argument('--tier', default='efficientnetb0', help="model tier")
+    parser.add_argument('--output', help="write the results JSON here (stdout if not given)")
+    parser.add_argument('--baseline', help="baseline results JSON to compare against (default: %s if it exists)" % DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="allowed relative regression per metric")
+    parser.add_argument('--save-baseline', metavar='PATH', help="also write the results as a new baseline")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, SERVICE_DIR)
+    import QOne1
+    settings = {'model_store': args.model_store or QOne1.DEFAULT_MODEL_STORE, 'backend': args.backend, 'tier': args.tier}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = QOne1.list_image_files(args.corpus) if args.corpus else QOne1.write_synthetic_photos(tmp_dir, [(1600, 1200)] * SYNTHETIC_IMAGES)
+        if not paths:
+            print(f"No PNG/JPG/JPEG files found in {args.corpus}")
+            return 1
+        print(f"Benchmarking on {len(paths)} image(s)...", file=sys.stderr)
+        metrics = run_suite(settings, paths, args.batch_sizes)
+
+    results = {'time': time.time(), 'host': {'node': platform.node(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+                                              'python': platform.python_version()},
+               'settings': dict(settings, corpus=args.corpus or 'synthetic', images=len(paths)), 'metrics': metrics}
+    text = json.dumps(results, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text + "\n")
+
+    baseline_path = args.baseline
+    if baseline_path is None and not args.save_baseline and os.path.isfile(DEFAULT_BASELINE):
+        baseline_path = DEFAULT_BASELINE
+    if baseline_path is None and not args.save_baseline:
+        print(f"No baseline to compare against; record one with --save-baseline {DEFAULT_BASELINE}", file=sys.stderr)
+    elif baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get('host') != results['host']:
+            print(f"Warning: {baseline_path} was recorded on another host ({baseline.get('host')})", file=sys.stderr)
+        regressions = compare(metrics, baseline['metrics'], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+        print(f"No metric regressed by more than {args.tolerance:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,136 @@
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+from PIL import Image
+
+# Loopback load test for the inference service in QOne1.py (python QOne1.py --serve).
+# Without --url it starts the service once without batching (max batch 1) and once with
+# micro-batching, sends the same load to both and prints the throughput gain.
+
+SERVICE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'QOne1.py')
+
+# JPEG bytes of a synthetic photo, used when no image is given
+def synthetic_image(width=1024, height=768):
+    noise = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(noise).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def get_json(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+# Start the service and wait until it answers /health (loading the model can take a while)
+def start_service(port, max_batch_size, max_wait_ms, service_args, timeout=600):
+    command = [sys.executable, SERVICE_SCRIPT, '--serve', '--port', str(port),
+               '--max-batch-size', str(max_batch_size), '--max-wait-ms', str(max_wait_ms)] + service_args
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"service exited with code {process.returncode}")
+        try:
+            get_json(url + '/health', timeout=1)
+            return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("service did not start in time")
+
+# Send `total` classify requests from `concurrency` threads; returns (images/second, latencies in ms)
+def run_load(url, image_bytes, concurrency, total):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [total]
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            request = urllib.request.Request(url + '/classify?top=1', data=image_bytes,
+                                             headers={'Content-Type': 'application/octet-stream'})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=120) as response:
+                    response.read()
+            except OSError as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    # Warm up so one-off tracing is not counted
+    run_once = urllib.request.Request(url + '/classify', data=image_bytes, headers={'Content-Type': 'application/octet-stream'})
+    urllib.request.urlopen(run_once, timeout=600).read()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        print(f"  {len(errors)} request(s) failed, first error: {errors[0]}")
+    return len(latencies) / elapsed, latencies
+
+def report(name, url, throughput, latencies):
+    metrics = get_json(url + '/metrics')
+    queue_wait = metrics['latency'].get('queue_wait', {})
+    print(f"  {name:<22} {throughput:7.1f} img/s   p50 {np.percentile(latencies, 50):7.1f} ms   "
+          f"p95 {np.percentile(latencies, 95):7.1f} ms   mean batch {metrics['mean_batch_size']:5.1f}   "
+          f"queue p95 {queue_wait.get('p95_ms', 0):6.1f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the QOne1.py inference service")
+    parser.add_argument('--url', help="test an already running service instead of starting one")
+    parser.add_argument('--image', help="image sent with every request (synthetic photo if not given)")
+    parser.add_argument('--concurrency', type=int, default=16, help="number of concurrent clients")
+    parser.add_argument('--requests', type=int, default=256, help="requests per run")
+    parser.add_argument('--port', type=int, default=8765, help="port used for the started service")
+    parser.add_argument('--max-batch-size', type=int, default=32, help="micro-batch size of the batched run")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="micro-batch wait of the batched run")
+    parser.add_argument('--service-arg', action='append', default=[], help="extra argument for the started service (repeatable)")
+    args = parser.parse_args(argv)
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image_bytes = f.read()
+    else:
+        image_bytes = synthetic_image()
+
+    print(f"{args.requests} requests from {args.concurrency} concurrent clients:")
+    if args.url:
+        throughput, latencies = run_load(args.url, image_bytes, args.concurrency, args.requests)
+        report(args.url, args.url, throughput, latencies)
+        return 0
+
+    results = {}
+    for name, max_batch_size in (('no batching', 1), (f'micro-batching ({args.max_batch_size})', args.max_batch_size)):
+        process, url = start_service(args.port, max_batch_size, args.max_wait_ms, args.service_arg)
+        try:
+            throughput, latencies = run_load(url, image_bytes, args.concurrency, args.requests)
+            report(name, url, throughput, latencies)
+            results[max_batch_size] = throughput
+        finally:
+            process.terminate()
+            process.wait()
+    if results.get(1):
+        print(f"Throughput gain from batching: {results[args.max_batch_size] / results[1]:.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())